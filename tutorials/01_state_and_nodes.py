@@ -2,16 +2,20 @@
 # dependencies = ["langgraph"]
 # ///
 
-from typing import TypedDict, List
+import operator
+from typing import TypedDict, List, Annotated
 from langgraph.graph import StateGraph, START, END
 from utils.visualizer import visualize_graph
+from utils.logger import logger, flush_logs
+from utils.graph_builder import register_nodes, register_edges
 
 # ==========================================
 # 1. State (数据定义)
 # ==========================================
 class AgentState(TypedDict):
     sentence: str
-    processing_steps: List[str]
+    # operator.add 作为 reducer: 节点只返回新增的步骤，由 LangGraph 追加到列表末尾
+    processing_steps: Annotated[List[str], operator.add]
 
 # ==========================================
 # 2. Nodes (逻辑处理)
@@ -19,22 +23,22 @@ class AgentState(TypedDict):
 def uppercase_node(state: AgentState) -> AgentState:
     """将句子转换为大写"""
     original = state["sentence"]
-    # 打印简易日志
-    print(f"--- [Node: Uppercase] Processing: '{original}'")
+    # 记录简易日志 (交给后台线程写 stdout)
+    logger.info("--- [Node: Uppercase] Processing: '%s'", original)
     
     return {
         "sentence": original.upper(),
-        "processing_steps": state["processing_steps"] + ["Uppercase"]
+        "processing_steps": ["Uppercase"]
     }
 
 def reverse_node(state: AgentState) -> AgentState:
     """将句子反转"""
     original = state["sentence"]
-    print(f"--- [Node: Reverse]   Processing: '{original}'")
+    logger.info("--- [Node: Reverse]   Processing: '%s'", original)
     
     return {
         "sentence": original[::-1],
-        "processing_steps": state["processing_steps"] + ["Reverse"]
+        "processing_steps": ["Reverse"]
     }
 
 # ==========================================
@@ -44,13 +48,17 @@ def main():
     # --- A. 构建图 ---
     builder = StateGraph(AgentState)
 
-    builder.add_node("upper_caser", uppercase_node)
-    builder.add_node("reverser", reverse_node)
+    register_nodes(builder, {
+        "upper_caser": uppercase_node,
+        "reverser": reverse_node,
+    })
 
     # 定义线性流: START -> upper_caser -> reverser -> END
-    builder.add_edge(START, "upper_caser")
-    builder.add_edge("upper_caser", "reverser")
-    builder.add_edge("reverser", END)
+    register_edges(builder, [
+        (START, "upper_caser"),
+        ("upper_caser", "reverser"),
+        ("reverser", END),
+    ])
 
     graph = builder.compile()
 
@@ -67,6 +75,8 @@ def main():
     
     # 触发执行
     result = graph.invoke(initial_input)
+    # 节点日志由后台线程输出，先等它们写完，保证 [End] 打印在节点日志之后
+    flush_logs()
     
     print(f"[End]   Result: {result}\n")
 
@@ -1,20 +1,24 @@
-
-from typing import TypedDict, Annotated
+import asyncio
+import sys
+from typing import TypedDict
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.messages import HumanMessage, ToolMessage
 from langchain_core.tools import tool
-from langgraph.graph import StateGraph, START, END
-from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode, tools_condition
+from langgraph.graph import StateGraph, MessagesState, START, END
+from langgraph.types import Send
 from utils.visualizer import visualize_graph
+from utils.llm import get_llm
+from utils.logger import logger, flush_logs
+from utils.graph_builder import register_nodes, register_edges
 
 load_dotenv()
 
 # 1. State
-class AgentState(TypedDict):
-    messages: Annotated[list[BaseMessage], add_messages]
+# 全局状态直接使用内置的 MessagesState (messages + add_messages reducer)
+# 单个工具调用的局部状态 (由 Send 传入，不属于全局 State)
+class ToolCallState(TypedDict):
+    tool_call: dict
 
 # 2. Tools
 @tool
@@ -28,43 +32,64 @@ def get_weather(city: str) -> str:
     return f"The weather in {city} is sunny and 25°C."
 
 tools = [multiply, get_weather]
+# 按名字预先建好索引，tool_runner 只需一次 dict 查找
+tools_by_name = {t.name: t for t in tools}
 
 # 3. Nodes
-llm = ChatOpenAI(model="gpt-4.1-nano", temperature=0)
+llm = get_llm("gpt-4.1-nano", 0)
 llm_with_tools = llm.bind_tools(tools)
 
-def agent_node(state: AgentState):
-    print("--- [Node: Agent] Thinking... ---")
-    result = llm_with_tools.invoke(state["messages"])
-    print(f"--- [Node: Agent] Output: {result.content} (Tool Calls: {len(result.tool_calls)})")
+async def agent_node(state: MessagesState):
+    logger.info("--- [Node: Agent] Thinking... ---")
+    # ainvoke: 等待 OpenAI 响应时让出 event loop，不阻塞其他并发的 graph run
+    result = await llm_with_tools.ainvoke(state["messages"])
+    logger.info("--- [Node: Agent] Output: %s (Tool Calls: %d)", result.content, len(result.tool_calls))
     return {"messages": [result]}
 
-# 4. Graph Construction
-def main():
-    builder = StateGraph(AgentState)
-
-    builder.add_node("agent", agent_node)
-    # 使用自定义的 ToolNode 以便于打印日志 (可选，如果不介意直接用 prebuilt)
-    # 但为了简单，我们还是用 prebuilt ToolNode，它本身不打印日志。
-    # 我们可以通过监听 graph 的输出来实现更直观的流式展示
-    builder.add_node("tools", ToolNode(tools))
-
-    builder.add_edge(START, "agent")
+async def tool_runner_node(state: ToolCallState):
+    """只执行一个工具调用，多个调用由 Send 并行分发"""
+    tool_call = state["tool_call"]
+    logger.info("--- [Node: Tool Runner] Running: %s ---", tool_call["name"])
+    output = await tools_by_name[tool_call["name"]].ainvoke(tool_call["args"])
+    # 并发写入的 ToolMessage 由 add_messages reducer 合并
+    return {"messages": [ToolMessage(content=str(output), tool_call_id=tool_call["id"], name=tool_call["name"])]}
+
+# 4. Router
+def dispatch_tools(state: MessagesState):
+    """LLM 一次返回多个 tool_calls 时，每个调用各自成为一个并行任务"""
+    last_message = state["messages"][-1]
+    if not last_message.tool_calls:
+        return END
+    return [Send("tool_runner", {"tool_call": tc}) for tc in last_message.tool_calls]
+
+# 5. Graph Construction
+def _build_graph():
+    builder = StateGraph(MessagesState)
+
+    # 不使用 prebuilt ToolNode：它在同一个任务里依次执行所有 tool_calls。
+    # 这里每个工具调用都是独立的 tool_runner 任务，在同一个 superstep 内并行执行。
+    register_nodes(builder, {
+        "agent": agent_node,
+        "tool_runner": tool_runner_node,
+    })
+
+    # 所有 tool_runner 完成后才会回到 agent
+    register_edges(builder, [
+        (START, "agent"),
+        ("tool_runner", "agent"),
+    ])
     
     # [高级工程师写法]: 
-    # 使用 tools_condition (标准) + 显式 Path Map (清晰)
-    builder.add_conditional_edges(
-        "agent",
-        tools_condition,
-        {
-            "tools": "tools",
-            END: END
-        }
-    )
+    # 路由函数返回 Send 列表 (Map) + 显式 Path Map (清晰)
+    builder.add_conditional_edges("agent", dispatch_tools, ["tool_runner", END])
+
+    return builder.compile()
 
-    builder.add_edge("tools", "agent")
+# 模块加载时编译一次 (compile 会做 validate)，之后每次运行直接复用
+GRAPH = _build_graph()
 
-    graph = builder.compile()
+async def main():
+    graph = GRAPH
 
     # Visualization
     visualize_graph(graph, "03_graph_structure.png")
@@ -75,29 +100,22 @@ def main():
     print(f"Initial Input: {initial_input['messages'][0].content}")
     
     print("\n--- Start Streaming ---")
-    # 使用 stream 模式来实时查看每一步的输出
-    # stream_mode="updates" 会返回每个节点更新后的状态增量
-    for event in graph.stream(initial_input, stream_mode="updates"):
-        for node_name, state_update in event.items():
-            print(f"\n[Update from Node: {node_name}]")
-            
-            # 解析消息更新
-            if "messages" in state_update:
-                messages = state_update["messages"]
-                for msg in messages:
-                    # 根据消息类型打印不同格式
-                    if hasattr(msg, "tool_calls") and msg.tool_calls:
-                         # AI Message 且包含工具调用
-                        for tc in msg.tool_calls:
-                            print(f"  🤖 AI Request Tool: {tc['name']} (Args: {tc['args']})")
-                    elif hasattr(msg, "content") and msg.content:
-                        # 普通内容
-                        prefix = "  🛠️ Tool Output" if node_name == "tools" else "  🤖 AI Message"
-                        print(f"{prefix}: {msg.content}")
-                    else:
-                        print(f"  (Raw Message): {msg}")
+    # stream_mode="messages": LLM 每生成一个 token 就立即推送 (首 token 延迟最低)，
+    # 不必等节点跑完再拿到整条消息。metadata["langgraph_node"] 标明消息来自哪个节点。
+    # 工具调用请求见 agent 节点的日志 (Tool Calls: N)。
+    async for chunk, metadata in graph.astream(initial_input, stream_mode="messages"):
+        # 节点日志由后台线程输出，写 stdout 之前先等已有日志写完，避免和 token 交错 (队列为空时立即返回)
+        flush_logs()
+        if isinstance(chunk, ToolMessage):
+            # 工具结果是完整消息，不是 token 流
+            print(f"\n  🛠️ Tool Output: {chunk.content}")
+        elif chunk.content:
+            # AI 回复的 token 片段，直接写到 stdout
+            sys.stdout.write(chunk.content)
+            sys.stdout.flush()
     
+    flush_logs()
     print("\n--- End Streaming ---")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
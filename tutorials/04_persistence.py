@@ -1,26 +1,27 @@
-import sqlite3
-from typing import TypedDict, Annotated
+import asyncio
+from typing import TypedDict
 from dotenv import load_dotenv
-import uuid
+from uuid import uuid7
+import aiosqlite
 
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.messages import HumanMessage, ToolMessage, trim_messages
 from langchain_core.tools import tool
-from langgraph.graph import StateGraph, START, END
-from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode, tools_condition
-from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import StateGraph, MessagesState, START, END
+from langgraph.types import Send
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
 # 使用你自定义的可视化工具
 from utils.visualizer import visualize_graph
+from utils.llm import get_llm
+from utils.graph_builder import register_nodes, register_edges
 
 load_dotenv()
 
 # ==========================================
 # 1. State & Tools
 # ==========================================
-class AgentState(TypedDict):
-    messages: Annotated[list[BaseMessage], add_messages]
+class ToolCallState(TypedDict):
+    tool_call: dict
 
 @tool
 def multiply(a: int, b: int) -> int:
@@ -33,29 +34,77 @@ def get_weather(city: str) -> str:
     return f"The weather in {city} is sunny and 25°C."
 
 tools = [multiply, get_weather]
+# 按名字预先建好索引，tool_runner 只需一次 dict 查找
+tools_by_name = {t.name: t for t in tools}
 
 # ==========================================
 # 2. Nodes & Model
 # ==========================================
-llm = ChatOpenAI(model="gpt-4.1-nano", temperature=0)
+llm = get_llm("gpt-4.1-nano", 0)
 llm_with_tools = llm.bind_tools(tools)
 
-def agent_node(state: AgentState):
-    return {"messages": [llm_with_tools.invoke(state["messages"])]}
+async def agent_node(state: MessagesState):
+    # 历史随对话无限增长，只把最近 ~2048 tokens 发给 LLM (完整历史仍在 checkpoint 中)
+    # start_on="human": 截断后不能以孤立的 ToolMessage 开头
+    trimmed = trim_messages(
+        state["messages"],
+        token_counter=llm,
+        max_tokens=2048,
+        strategy="last",
+        start_on="human",
+        end_on=("human", "tool"),
+        include_system=True,
+    )
+    return {"messages": [await llm_with_tools.ainvoke(trimmed)]}
+
+async def tool_runner_node(state: ToolCallState):
+    tool_call = state["tool_call"]
+    output = await tools_by_name[tool_call["name"]].ainvoke(tool_call["args"])
+    return {"messages": [ToolMessage(content=str(output), tool_call_id=tool_call["id"], name=tool_call["name"])]}
+
+def dispatch_tools(state: MessagesState):
+    # 每个 tool_call 一个 Send，并行执行
+    last_message = state["messages"][-1]
+    if not last_message.tool_calls:
+        return END
+    return [Send("tool_runner", {"tool_call": tc}) for tc in last_message.tool_calls]
+
+def _build_builder():
+    builder = StateGraph(MessagesState)
+    
+    register_nodes(builder, {
+        "agent": agent_node,
+        "tool_runner": tool_runner_node,
+    })
+    
+    register_edges(builder, [
+        (START, "agent"),
+        ("tool_runner", "agent"),
+    ])
+    builder.add_conditional_edges("agent", dispatch_tools, ["tool_runner", END])
+    return builder
+
+# 图结构只在模块加载时构建一次；checkpointer 依赖运行时打开的连接，所以 compile 留到 run_demo
+BUILDER = _build_builder()
 
 # ==========================================
 # 3. Main Logic
 # ==========================================
-def main():
+async def main():
     # --- A. Setup Database ---
-    # check_same_thread=False 允许在多线程环境下使用 SQLite
-    conn = sqlite3.connect("tutorials/checkpoints/checkpoints.sqlite", check_same_thread=False)
-
-    # --- B. Build Graph & Inject Checkpointer ---
     # 使用 Context Manager 自动管理连接生命周期
-    # with SqliteSaver(conn) as checkpointer:
-    checkpointer = SqliteSaver(conn)
-
+    async with aiosqlite.connect("tutorials/checkpoints/checkpoints.sqlite", isolation_level=None) as conn:
+        # WAL: 读不阻塞写；synchronous=NORMAL: 不在每次 commit 时 fsync
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+
+        # --- B. Inject Checkpointer ---
+        # 同步的 SqliteSaver 不支持 ainvoke，异步图必须搭配 AsyncSqliteSaver
+        checkpointer = AsyncSqliteSaver(conn)
+        await run_demo(checkpointer)
+
+async def run_demo(checkpointer):
+    """构建图并模拟多会话 (checkpointer 的生命周期由 main 管理)"""
     # ==========================================
     # LangGraph Persistence 核心机制笔记:
     # 
@@ -73,6 +122,10 @@ def main():
     #    - 并不是每产生一条消息就写一次 IO，而是在每一个 "Superstep (超步)" 结束时写入。
     #    - 流程: Node 执行 -> 返回 Update -> Reducer 合并状态 (如 add_messages) -> Checkpointer.put 写入数据库。
     #    - 这确保了每一步执行后的状态都是可恢复的 (Time Travel 基础)。
+    #
+    # 4. 序列化 (Serde):
+    #    - Checkpointer 默认使用 JsonPlusSerializer，它的 dumps_typed 走的是 ormsgpack (Rust 实现的 msgpack)，
+    #      并不是标准库 json。所以没有必要再套一层 orjson，自定义 serde 反而会绕开 LangChain 对象的编码扩展。
     # 
     # ------------------------------------------
     # 生产环境高并发架构思考 (10k+ QPS):
@@ -96,21 +149,8 @@ def main():
     #    - 结合技术: Ray (Python 的分布式计算框架) 或 Orleans (Actor 模型)。
     # ==========================================
 
-    builder = StateGraph(AgentState)
-    
-    builder.add_node("agent", agent_node)
-    builder.add_node("tools", ToolNode(tools))
-    
-    builder.add_edge(START, "agent")
-    builder.add_conditional_edges(
-        "agent",
-        tools_condition,
-        {"tools": "tools", END: END}
-    )
-    builder.add_edge("tools", "agent")
-
     # [关键]: 编译时传入 checkpointer
-    graph = builder.compile(checkpointer=checkpointer)
+    graph = BUILDER.compile(checkpointer=checkpointer)
 
     # --- C. Visualization ---
     visualize_graph(graph, "04_graph_structure.png")
@@ -118,12 +158,13 @@ def main():
     # --- D. Simulation: Thread Isolation ---
     
     # 场景 1: 用户 Neo (建立记忆)
-    config_neo = {"configurable": {"thread_id": f"user_neo_{uuid.uuid4()}"}}
+    # uuid7 按时间递增，checkpoints 表的索引写入更集中
+    config_neo = {"configurable": {"thread_id": f"user_neo_{uuid7()}"}}
     
     # 第一轮对话
     print(f"\n=== Session: user_neo ===")
     print("User: Hi, I'm Neo.")
-    result_neo = graph.invoke(
+    result_neo = await graph.ainvoke(
         {"messages": [HumanMessage(content="Hi, I'm Neo.")]}, 
         config=config_neo
     )
@@ -131,11 +172,11 @@ def main():
 
     # 第二轮对话
     print("\nUser: What is my name?")
-    result_neo = graph.invoke(
+    result_neo = await graph.ainvoke(
         {"messages": [HumanMessage(content="What is my name?")]}, 
         config=config_neo
     )
     print(f"Agent: {result_neo['messages'][-1].content}")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -9,43 +9,63 @@
 
 import uuid
 import sys
-from typing import TypedDict, Annotated
+import functools
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, trim_messages
 from langchain_core.tools import tool
-from langgraph.graph import StateGraph, START, END
-from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode, tools_condition
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import StateGraph, MessagesState, START, END
+from langgraph.prebuilt import tools_condition
 
 from utils.visualizer import visualize_graph
+from utils.llm import get_llm
+from utils.graph_builder import register_nodes, register_edges
+from utils.savers import LatestOnlySaver
 
 load_dotenv()
 
 # ==========================================
 # 1. State & Tools
 # ==========================================
-class AgentState(TypedDict):
-    messages: Annotated[list[BaseMessage], add_messages]
-
 @tool
 def buy_stock(ticker: str, amount: int) -> str:
     """Executes a stock purchase trade."""
     return f"✅ SUCCESS: Bought {amount} shares of {ticker}."
 
 tools = [buy_stock]
+tools_by_name = {t.name: t for t in tools}
 
 # ==========================================
 # 2. Nodes
 # ==========================================
-llm = ChatOpenAI(model="gpt-4.1-nano", temperature=0)
+llm = get_llm("gpt-4.1-nano", 0)
 llm_with_tools = llm.bind_tools(tools)
 
-# 这里 llm 会看到整个对话历史，包括工具调用和人类干预。
-def agent_node(state: AgentState):
-    return {"messages": [llm_with_tools.invoke(state["messages"])]}
+# 这里 llm 会看到对话历史，包括工具调用和人类干预。
+# 为了控制 token 成本，只保留最近 ~2048 tokens (start_on="human" 保证工具调用/结果不被拆散)。
+def agent_node(state: MessagesState):
+    trimmed = trim_messages(
+        state["messages"],
+        token_counter=llm,
+        max_tokens=2048,
+        strategy="last",
+        start_on="human",
+        end_on=("human", "tool"),
+        include_system=True,
+    )
+    return {"messages": [llm_with_tools.invoke(trimmed)]}
+
+# 替代 prebuilt ToolNode: 每个 tool_call 直接按名字查表执行
+def tool_node(state: MessagesState):
+    last_message = state["messages"][-1]
+    return {"messages": [
+        ToolMessage(
+            content=str(tools_by_name[tc["name"]].invoke(tc["args"])),
+            tool_call_id=tc["id"],
+            name=tc["name"]
+        )
+        for tc in last_message.tool_calls
+    ]}
 
 # ==========================================
 # 3. Helper Functions
@@ -61,6 +81,14 @@ def resume_graph(graph, config, input_payload=None):
             elif isinstance(last_msg, ToolMessage):
                 print(f"🛠️  Tool Output: {last_msg.content}")
 
+# 审计日志: 按消息的精确类型查表 (这三种消息类型足够，不需要 isinstance 链)
+ICONS = {
+    HumanMessage: ("HUMAN", "👤"),
+    AIMessage: ("AI   ", "🤖"),
+    ToolMessage: ("TOOL ", "🛠️"),
+}
+UNKNOWN_ICON = ("UNKNOWN", "❓")
+
 def print_audit_log(graph, config):
     """打印完整的对话历史审计日志"""
     print("\n" + "="*60)
@@ -70,15 +98,9 @@ def print_audit_log(graph, config):
     final_snapshot = graph.get_state(config)
     all_messages = final_snapshot.values.get("messages", [])
 
-    for i, msg in enumerate(all_messages):
-        role = "UNKNOWN"
-        icon = "❓"
-        if isinstance(msg, HumanMessage):
-            role, icon = "HUMAN", "👤"
-        elif isinstance(msg, AIMessage):
-            role, icon = "AI   ", "🤖"
-        elif isinstance(msg, ToolMessage):
-            role, icon = "TOOL ", "🛠️"
+    lines = []
+    for msg in all_messages:
+        role, icon = ICONS.get(type(msg), UNKNOWN_ICON)
 
         content = msg.content
         extra_info = ""
@@ -87,20 +109,30 @@ def print_audit_log(graph, config):
             call_details = [f"{c['name']}{c['args']}" for c in msg.tool_calls]
             extra_info = f"\n   >>> [Tool Request]: {', '.join(call_details)}"
         
-        print(f"{icon}  [{role}]: {content}{extra_info}")
-        print("-" * 60)
+        lines.append(f"{icon}  [{role}]: {content}{extra_info}")
+        lines.append("-" * 60)
+
+    # 一次 print 输出整段日志
+    print("\n".join(lines))
 
 # ==========================================
 # 4. Graph Setup
 # ==========================================
+# 只构建/编译一次；缓存的图共享同一个 Checkpointer
+@functools.lru_cache(maxsize=1)
 def build_graph():
-    checkpointer = MemorySaver()
-    builder = StateGraph(AgentState)
-    builder.add_node("agent", agent_node)
-    builder.add_node("action", ToolNode(tools))
-    builder.add_edge(START, "agent")
+    # HITL 恢复执行只需要断点处的最新快照，不需要 MemorySaver 的完整历史和序列化
+    checkpointer = LatestOnlySaver()
+    builder = StateGraph(MessagesState)
+    register_nodes(builder, {
+        "agent": agent_node,
+        "action": tool_node,
+    })
+    register_edges(builder, [
+        (START, "agent"),
+        ("action", "agent"),
+    ])
     builder.add_conditional_edges("agent", tools_condition, {"tools": "action", END: END})
-    builder.add_edge("action", "agent")
     
     return builder.compile(checkpointer=checkpointer, interrupt_before=["action"])
 
@@ -7,21 +7,24 @@
 # ]
 # ///
 
+import asyncio
 import operator
-import uuid
-from typing import TypedDict, Annotated, List
+from uuid import uuid7
+from typing import TypedDict, Annotated, List, Literal
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
 from pydantic import BaseModel, Field
 
 from langgraph.graph import StateGraph, START, END
-from langgraph.types import Send
+from langgraph.types import Command, Send
 from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
 
 from utils.visualizer import visualize_graph
+from utils.llm import get_llm
+from utils.logger import logger, flush_logs
+from utils.graph_builder import register_nodes, register_edges
 
 load_dotenv()
 
@@ -48,30 +51,39 @@ class WorkerState(TypedDict):
 # ==========================================
 
 # 这里的 llms 都只看到当前的输入，不会看到历史记录。
-llm_planner = ChatOpenAI(model="gpt-4o-mini", temperature=0.6)
+llm_planner = get_llm("gpt-4o-mini", 0.6)
 
 class Subjects(BaseModel):
     subjects: List[str] = Field(description="A list of subjects to generate jokes about")
 
-def planner_node(state: OverallState):
-    print(f"--- [Planner] Analyzing topic: {state['topic']} ---")
+# 结构化输出的 Runnable 只需要构建一次，不必每次调用 planner 都重新绑定 schema
+planner_llm = llm_planner.with_structured_output(Subjects)
+
+async def planner_node(state: OverallState) -> Command[Literal["generate_joke"]]:
+    logger.info("--- [Planner] Analyzing topic: %s ---", state["topic"])
     
-    structured_llm = llm_planner.with_structured_output(Subjects)
-    structured_result = structured_llm.invoke(f"Extract subjects from: {state['topic']}")
+    structured_result = await planner_llm.ainvoke(f"Extract subjects from: {state['topic']}")
     
     # [Action]: 返回 subjects 数据，同时记录一条 AIMessage 到历史记录
-    return {
-        "subjects": structured_result.subjects,
-        "messages": [AIMessage(content=f"PLANNER: I have split the task into: {structured_result.subjects}")]
-    }
-
-llm_joke = ChatOpenAI(model="gpt-4.1-nano", temperature=0.9)
-
-def generation_node(state: WorkerState):
+    # 用 Command 把状态更新和 Send 分发放在同一步完成，不再需要单独的路由函数
+    return Command(
+        update={
+            "subjects": structured_result.subjects,
+            "messages": [AIMessage(content=f"PLANNER: I have split the task into: {structured_result.subjects}")]
+        },
+        goto=[Send("generate_joke", {"section_subject": s}) for s in structured_result.subjects]
+    )
+
+llm_joke = get_llm("gpt-4.1-nano", 0.9)
+
+# Send 只负责把 Worker 分发到同一个 superstep；
+# 只有节点是 async 且在 await 处让出 event loop，多个 LLM 请求才会真正同时在途。
+async def generation_node(state: WorkerState):
     subject = state["section_subject"]
-    print(f"  -> [Worker] Processing: {subject}")
+    # 并行 Worker 只往队列里放日志，不在 stdout 上互相等待
+    logger.info("  -> [Worker] Processing: %s", subject)
     
-    response = llm_joke.invoke(f"Tell me a one-sentence joke about {subject}.")
+    response = await llm_joke.ainvoke(f"Tell me a one-sentence joke about {subject}.")
     joke = f"{subject.upper()}: {response.content}"
     
     # [Action]: 返回 joke 数据，同时记录一条 AIMessage
@@ -81,19 +93,12 @@ def generation_node(state: WorkerState):
         "messages": [AIMessage(content=f"WORKER({subject}): Generated joke -> {response.content}")]
     }
 
-def reducer_node(state: OverallState):
+async def reducer_node(state: OverallState):
+    # 不需要"等齐了没有"的检查: 所有 Send 出去的 Worker 在同一个 superstep 内执行，
+    # generate_joke -> reduce 这条边会在它们全部完成后只触发一次 reduce。
     jokes = state.get("jokes", [])
-    subjects = state.get("subjects", [])
-    
-    # [Check]: Wait for all subjects to be processed
-    if len(jokes) < len(subjects):
-        return {}
-    
-    # [Check]: Avoid duplicate execution (Idempotency)
-    if state.get("final_report"):
-        return {}
 
-    print("--- [Reducer] Combining results ---")
+    logger.info("--- [Reducer] Combining results ---")
     summary = "\n".join(jokes)
     
     final_msg = f"Here is the collected humor report:\n\n{summary}"
@@ -106,10 +111,15 @@ def reducer_node(state: OverallState):
 # ==========================================
 # 3. Logic & Helper
 # ==========================================
-def continue_to_jokes(state: OverallState):
-    return [Send("generate_joke", {"section_subject": s}) for s in state["subjects"]]
-
 # --- 你的审计函数 ---
+# 审计日志: 按消息的精确类型查表 (这三种消息类型足够，不需要 isinstance 链)
+ICONS = {
+    HumanMessage: ("HUMAN", "👤"),
+    AIMessage: ("AI   ", "🤖"),
+    ToolMessage: ("TOOL ", "🛠️"),
+}
+UNKNOWN_ICON = ("UNKNOWN", "❓")
+
 def print_audit_log(graph, config):
     """打印完整的对话历史审计日志"""
     print("\n" + "="*60)
@@ -120,39 +130,38 @@ def print_audit_log(graph, config):
     final_snapshot = graph.get_state(config)
     all_messages = final_snapshot.values.get("messages", [])
 
-    for i, msg in enumerate(all_messages):
-        role = "UNKNOWN"
-        icon = "❓"
-        if isinstance(msg, HumanMessage):
-            role, icon = "HUMAN", "👤"
-        elif isinstance(msg, AIMessage):
-            # 这里我们通过 content 前缀来区分是 Planner 还是 Worker
-            role, icon = "AI   ", "🤖"
-        elif isinstance(msg, ToolMessage):
-            role, icon = "TOOL ", "🛠️"
-
-        content = msg.content
-        print(f"{icon}  [{role}]: {content}")
-        print("-" * 60)
+    lines = []
+    for msg in all_messages:
+        # AI 消息通过 content 前缀来区分是 Planner 还是 Worker
+        role, icon = ICONS.get(type(msg), UNKNOWN_ICON)
+        lines.append(f"{icon}  [{role}]: {msg.content}")
+        lines.append("-" * 60)
+
+    # 一次 print 输出整段日志
+    print("\n".join(lines))
 
 # ==========================================
 # 4. Graph Construction
 # ==========================================
-def main():
+async def main():
     # [Setup]: 使用 MemorySaver
     checkpointer = MemorySaver()
     
     # 这里定义了 OverallState 作为 StateGraph 的 State 类型，类似于一个全局状态。
     builder = StateGraph(OverallState)
-    builder.add_node("planner", planner_node)
-    builder.add_node("generate_joke", generation_node)
-    builder.add_node("reduce", reducer_node)
-
-    builder.add_edge(START, "planner")
-    builder.add_conditional_edges("planner", continue_to_jokes, ["generate_joke"])
-    # [Changed]: Directly connect to reducer, let reducer handle synchronization
-    builder.add_edge("generate_joke", "reduce")
-    builder.add_edge("reduce", END)
+    register_nodes(builder, {
+        "planner": planner_node,
+        "generate_joke": generation_node,
+        "reduce": reducer_node,
+    })
+
+    # planner -> generate_joke 由 planner 返回的 Command(goto=[Send...]) 决定，无需条件边
+    # [Join]: 所有 Worker 完成后，reduce 只执行一次
+    register_edges(builder, [
+        (START, "planner"),
+        ("generate_joke", "reduce"),
+        ("reduce", END),
+    ])
 
     # 全图共享内存 checkpointer，用于在多个节点之间共享状态。
     graph = builder.compile(checkpointer=checkpointer)
@@ -162,7 +171,7 @@ def main():
     # ==========================================
     # 5. Execution
     # ==========================================
-    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    config = {"configurable": {"thread_id": str(uuid7())}}
     user_input = "Tell me jokes about basketball, dogs, and python."
     
     print(f"User Request: {user_input}\n")
@@ -175,15 +184,17 @@ def main():
 
     # 运行流
     # 注意：Map-Reduce 可能会产生很多 steps，stream_mode="updates" 可以看到每一步谁完成了
-    for event in graph.stream(initial_state, config=config):
+    async for event in graph.astream(initial_state, config=config):
         # 这里我们只打印简单的进度点，详细的看 Audit Log
+        # 节点日志由后台线程输出，print 之前先等已有日志写完，保证输出顺序与执行顺序一致
+        flush_logs()
         for key, value in event.items():
             if key == "generate_joke":
                 # 尝试从 message 里提取 info，或者直接打印
                 print(f" ✅ Worker finished a task.")
 
     # 打印最终报告
-    final_state = graph.get_state(config).values
+    final_state = (await graph.aget_state(config)).values
     if "final_report" in final_state:
         print("\n" + "="*40)
         print(f"FINAL REPORT:\n{final_state['final_report']}")
@@ -195,4 +206,4 @@ def main():
     print_audit_log(graph, config)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
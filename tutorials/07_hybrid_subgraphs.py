@@ -4,27 +4,37 @@
 #     "langchain-openai",
 #     "langchain-core",
 #     "python-dotenv",
-#     "langchain"
+#     "langchain",
+#     "langgraph-checkpoint-sqlite"
 # ]
 # ///
 
+import asyncio
+import functools
+import hashlib
+import json
 import operator
+import os
+from uuid import uuid7
 from typing import TypedDict, Annotated, List
+import aiosqlite
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from openai import AsyncOpenAI
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
 from langchain_core.tools import tool
 from pydantic import BaseModel, Field
 
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langgraph.checkpoint.memory import MemorySaver
 # from langgraph.prebuilt import create_react_agent
 from langchain.agents import create_agent
-from langgraph.types import Send
+from langgraph.types import CachePolicy, Send
+from langgraph.cache.sqlite import SqliteCache
 
 from utils.visualizer import visualize_graph
+from utils.llm import get_llm
+from utils.sqlite_savers import CoalescingAsyncSqliteSaver
 
 load_dotenv()
 
@@ -33,8 +43,11 @@ load_dotenv()
 # Pattern: Prebuilt ReAct (Standard Blackbox)
 # ==========================================
 
+# async 工具：Researcher 与 speculative_planner 在同一个 event loop 上并行，
+# 同步工具在 ainvoke 下会被丢到线程池执行 (每次调用占一个线程)；换成真实搜索 API 时在这里 await 异步 HTTP 请求
+# (例如 utils.llm.SHARED_HTTP_ASYNC_CLIENT.get(...))，不会卡住其它节点。
 @tool
-def search_web(query: str) -> str:
+async def search_web(query: str) -> str:
     """Useful for searching tech trends."""
     print(f"    [Child A: Tool] Searching web for: {query}")
     return (
@@ -44,9 +57,17 @@ def search_web(query: str) -> str:
         "3. Integration of Map-Reduce patterns for complex tasks."
     )
 
-llm_researcher = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+llm_researcher = get_llm("gpt-4o-mini", 0, cached=True)
+# 让模型在第一轮就把主题拆成几个子问题，一次性发出多个 search_web 调用 (OpenAI parallel tool calls)；
+# create_agent 会把同一轮的多个 tool call 并行执行，k 次"思考 -> 搜索"往返变成 1 次
+RESEARCHER_PROMPT = (
+    "You are a tech researcher. Break the topic into 2-3 focused sub-questions and call "
+    "search_web for ALL of them in a single turn (parallel tool calls), then write a concise "
+    "research memo from the combined results."
+)
+
 # 直接创建一个标准的 ReAct 图
-research_graph = create_agent(llm_researcher, tools=[search_web])
+research_graph = create_agent(llm_researcher, tools=[search_web], system_prompt=RESEARCHER_PROMPT)
 
 
 # ==========================================
@@ -72,36 +93,100 @@ class SectionState(TypedDict):
     context: str
 
 # --- 2.2 Nodes for Writer ---
-llm_writer = ChatOpenAI(model="gpt-4o-mini", temperature=0.7)
+llm_writer = get_llm("gpt-4o-mini", 0.7)
 
 class SectionSchema(BaseModel):
     sections: List[str] = Field(description="List of section titles, e.g. ['Intro', 'Deep Dive', 'Conclusion']")
 
-def planner_node(state: WriterState):
+# 结构化输出的 Runnable 只需要构建一次，不必每次调用 planner 都重新绑定 schema
+planner_llm = llm_writer.with_structured_output(SectionSchema)
+
+async def planner_node(state: WriterState):
     """拆解写作任务"""
     print(f"    [Child B: Planner] Splitting task: {state['request']}")
-    structured_llm = llm_writer.with_structured_output(SectionSchema)
-    result = structured_llm.invoke(f"Plan 3 short section titles for a post about: {state['request']}")
+    result = await planner_llm.ainvoke(f"Plan 3 short section titles for a post about: {state['request']}")
     
     return {
         "sections": result.sections,
         "messages": [AIMessage(content=f"[Writer Planner]: Split into {result.sections}")]
     }
 
-def write_section_node(state: SectionState):
-    """并行工作的写手节点"""
+def section_prompt(title: str, context: str) -> str:
+    return f"Write a very short paragraph for section '{title}' based on this context: {context}"
+
+async def write_section_node(state: SectionState):
+    """
+    并行工作的写手节点
+    必须是 async：Send 分发出的多个 Worker 在 await 处让出 event loop，N 个 LLM 请求同时在途。
+    """
     title = state["section_title"]
     print(f"    [Child B: Worker] Writing section: {title}")
     
-    prompt = f"Write a very short paragraph for section '{title}' based on this context: {state['context']}"
-    response = llm_writer.invoke(prompt)
+    response = await llm_writer.ainvoke(section_prompt(title, state["context"]))
     
     content = f"## {title}\n{response.content}"
     # 注意：Worker 无法直接写入 WriterState 的 messages，只能返回 drafts
     # 如果想记录 worker log，需要返回 {"messages": [...]} 并在 WriterState 里处理合并
     return {"drafts": [content]}
 
-def reducer_node(state: WriterState):
+# 非交互场景 (USE_BATCH_API=1): 所有章节打包成一个 OpenAI Batch 任务，价格约为实时接口的一半，
+# 但完成时间从秒级变成分钟~小时级 (completion_window 最长 24h)。
+USE_BATCH_API = os.environ.get("USE_BATCH_API") == "1"
+BATCH_POLL_SECONDS = 30
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+async def batch_write_sections_node(state: WriterState):
+    """
+    Batch 版写手节点：一次提交全部章节，轮询到完成后按 custom_id 还原顺序。
+    走的是 openai SDK 而不是 llm_writer (模型参数取自 llm_writer)。
+    """
+    sections = state["sections"]
+    print(f"    [Child B: Batch] Submitting {len(sections)} sections to Batch API...")
+
+    client = AsyncOpenAI()
+    requests = [
+        {
+            "custom_id": str(i),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": llm_writer.model_name,
+                "temperature": llm_writer.temperature,
+                "messages": [{"role": "user", "content": section_prompt(title, state["context"])}],
+            },
+        }
+        for i, title in enumerate(sections)
+    ]
+    jsonl = "\n".join(json.dumps(r) for r in requests).encode()
+
+    batch_file = await client.files.create(file=("sections.jsonl", jsonl), purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    while batch.status not in BATCH_FINAL_STATUSES:
+        await asyncio.sleep(BATCH_POLL_SECONDS)
+        batch = await client.batches.retrieve(batch.id)
+        print(f"    [Child B: Batch] {batch.id}: {batch.status}")
+
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"Batch {batch.id} ended with status '{batch.status}'")
+
+    # 输出文件里的行顺序不保证与输入一致，用 custom_id 对回章节
+    output = await client.files.content(batch.output_file_id)
+    contents = {}
+    for line in output.text.splitlines():
+        row = json.loads(line)
+        contents[int(row["custom_id"])] = row["response"]["body"]["choices"][0]["message"]["content"]
+
+    missing = [sections[i] for i in range(len(sections)) if i not in contents]
+    if missing:
+        raise RuntimeError(f"Batch {batch.id} returned no result for sections: {missing}")
+
+    return {"drafts": [f"## {title}\n{contents[i]}" for i, title in enumerate(sections)]}
+
+async def reducer_node(state: WriterState):
     """汇总节点"""
     print(f"    [Child B: Reducer] Compiling document...")
     full_text = "\n\n".join(state["drafts"])
@@ -112,23 +197,45 @@ def reducer_node(state: WriterState):
 
 # --- 2.3 Edges for Writer ---
 def route_to_workers(state: WriterState):
+    if USE_BATCH_API:
+        return "batch_write_sections"
     return [
         Send("write_section", {"section_title": s, "context": state["context"]})
         for s in state["sections"]
     ]
 
+def route_from_start(state: WriterState):
+    """调用方已经给出章节时跳过 planner，直接分发给 Worker"""
+    if state.get("sections"):
+        return route_to_workers(state)
+    return "planner"
+
+def section_cache_key(state: SectionState) -> str:
+    return hashlib.blake2b(f"{state['section_title']}|{state['context']}".encode(), digest_size=16).hexdigest()
+
 # 构建写手子图
 writer_builder = StateGraph(WriterState)
 writer_builder.add_node("planner", planner_node)
-writer_builder.add_node("write_section", write_section_node)
+# 章节草稿只取决于 (section_title, context)：重跑 Demo / 从 checkpoint 恢复时，
+# 相同的输入直接命中节点缓存，整个 Worker 都不会执行
+writer_builder.add_node("write_section", write_section_node, cache_policy=CachePolicy(key_func=section_cache_key))
+writer_builder.add_node("batch_write_sections", batch_write_sections_node)
 writer_builder.add_node("reducer", reducer_node)
 
-writer_builder.add_edge(START, "planner")
-writer_builder.add_conditional_edges("planner", route_to_workers, ["write_section"])
+writer_builder.add_conditional_edges(START, route_from_start, ["planner", "write_section", "batch_write_sections"])
+writer_builder.add_conditional_edges("planner", route_to_workers, ["write_section", "batch_write_sections"])
 writer_builder.add_edge("write_section", "reducer") # 所有 Worker 完工后去 Reducer
+writer_builder.add_edge("batch_write_sections", "reducer")
 writer_builder.add_edge("reducer", END)
 
-writing_graph = writer_builder.compile()
+# 节点缓存放在 tutorials/checkpoints/ 下 (按本文件定位，与当前工作目录无关)
+DRAFT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoints", "07_draft_cache.sqlite")
+
+# 子图结构在模块加载时就建好；SqliteCache 一创建就会打开 (新建) 数据库文件，
+# 所以 compile 推迟到第一次使用，import 本模块没有文件系统副作用
+@functools.lru_cache(maxsize=1)
+def get_writing_graph():
+    return writer_builder.compile(cache=SqliteCache(path=DRAFT_CACHE_PATH))
 
 
 # ==========================================
@@ -139,14 +246,15 @@ writing_graph = writer_builder.compile()
 class SuperGraphState(TypedDict):
     user_topic: str
     research_memo: str
+    sections: List[str]     # 与 Researcher 并行规划出的章节
     final_article: str
     messages: Annotated[List[BaseMessage], add_messages]
 
-llm_parent = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+llm_parent = get_llm("gpt-4o-mini", 0, cached=True)
 
-def research_node(state: SuperGraphState):
+async def research_node(state: SuperGraphState):
     """调用 Child A (ReAct)"""
-    print("--- [Parent] Step 1: Delegating to Researcher ---")
+    print("--- [Parent] Step 1a: Delegating to Researcher ---")
     
     # 1. 适配输入: ReAct Agent 需要 messages 列表
     child_input = {
@@ -154,7 +262,7 @@ def research_node(state: SuperGraphState):
     }
     
     # 2. 调用子图
-    result = research_graph.invoke(child_input)
+    result = await research_graph.ainvoke(child_input)
     
     # 3. 提取结果
     # 这里的 result['messages'][-1] 通常是 Agent 的最终回答
@@ -162,7 +270,7 @@ def research_node(state: SuperGraphState):
     
     # 4. 审计日志处理
     annotated_msgs = [
-        AIMessage(content=f"[Subgraph Researcher]: {m.content}") 
+        AIMessage(content=f"[Subgraph Researcher]: {m.content}", additional_kwargs={"role": "researcher"}) 
         for m in result["messages"] if isinstance(m, AIMessage)
     ]
     
@@ -171,27 +279,61 @@ def research_node(state: SuperGraphState):
         "messages": annotated_msgs
     }
 
-def writing_node(state: SuperGraphState):
-    """调用 Child B (Map-Reduce)"""
+async def speculative_planner_node(state: SuperGraphState):
+    """
+    投机执行: 提前规划章节 (与 Researcher 并行)
+    章节标题只依赖 user_topic，不需要等 research_memo，两个 LLM 调用可以同时在途。
+    投机失败时不影响主流程: sections 留空，Writer 子图会在拿到 research_memo 后自己规划。
+    """
+    print("--- [Parent] Step 1b: Speculatively planning sections (parallel with Researcher) ---")
+    
+    try:
+        result = await planner_node({"request": state["user_topic"]})
+    except Exception as e:
+        print(f"--- [Parent] Speculative planning failed, writer will plan itself: {e} ---")
+        return {"sections": []}
+    
+    annotated_msgs = [
+        AIMessage(content=f"[Subgraph Writer]: {m.content}", additional_kwargs={"role": "writer"}) 
+        for m in result["messages"]
+    ]
+    
+    return {
+        "sections": result["sections"],
+        "messages": annotated_msgs
+    }
+
+async def writer_workers_node(state: SuperGraphState):
+    """调用 Child B (Map-Reduce)，章节已规划好时子图会跳过 planner"""
     print("--- [Parent] Step 2: Delegating to Writers ---")
     
-    # 1. 适配输入: WriterState 需要 request 和 context
+    # 1. 适配输入: WriterState 需要 request 和 context (以及已规划好的 sections)
     child_input = {
         "request": state["user_topic"],
-        "context": state["research_memo"]
+        "context": state["research_memo"],
+        "sections": state["sections"]
     }
     
-    # 2. 调用子图
-    result = writing_graph.invoke(child_input)
+    # 2. 以 updates 模式流式调用子图
+    # 每个 Worker 一完成就会产出一条 update，草稿可以边到边处理，不必等最慢的 Worker；
+    # 最终全文仍由 reducer 在全部 Worker 完成后拼接 (只是一次字符串 join)。
+    article = ""
+    child_msgs = []
+    async for update in get_writing_graph().astream(child_input, stream_mode="updates"):
+        for node_name, node_update in update.items():
+            if not node_update:
+                continue
+            for draft in node_update.get("drafts", []):
+                print(f"    [Parent] Draft received: {draft.splitlines()[0]}")
+            if "final_doc" in node_update:
+                article = node_update["final_doc"]
+            child_msgs.extend(node_update.get("messages", []))
     
-    # 3. 提取结果
-    article = result["final_doc"]
-    
-    # 4. 审计日志处理
-    # Writer 子图的 messages 字段记录了 Planner 和 Reducer 的发言
+    # 3. 审计日志处理
+    # Writer 子图的 messages 字段记录了 Reducer 的发言 (Planner 的发言已由 speculative_planner 记录)
     annotated_msgs = [
-        AIMessage(content=f"[Subgraph Writer]: {m.content}") 
-        for m in result["messages"] if isinstance(m, AIMessage)
+        AIMessage(content=f"[Subgraph Writer]: {m.content}", additional_kwargs={"role": "writer"}) 
+        for m in child_msgs if isinstance(m, AIMessage)
     ]
     
     return {
@@ -203,67 +345,97 @@ def publisher_node(state: SuperGraphState):
     """父节点最后的润色"""
     print("--- [Parent] Step 3: Final Polish ---")
     return {
-        "messages": [AIMessage(content=f"EDITOR: Process complete. Article generated.")]
+        "messages": [AIMessage(content=f"EDITOR: Process complete. Article generated.", additional_kwargs={"role": "editor"})]
     }
 
 # ==========================================
 # PART 4: Build & Run
 # ==========================================
 
-def print_audit_log(graph, config):
+# 审计日志: 节点创建消息时在 additional_kwargs["role"] 打上角色标签，这里查表即可，
+# 不需要对每条消息做子串扫描。没有标签的 (用户输入) 按消息类型兜底。
+ROLE_ICONS = {
+    "researcher": "🕵️ ",
+    "writer": "✍️ ",
+    "editor": "👔",
+    "human": "👤",
+}
+
+async def print_audit_log(graph, config):
     print("\n" + "="*60)
     print("📜  FULL CONVERSATION HISTORY (AUDIT LOG)")
     print("="*60)
-    final_snapshot = graph.get_state(config)
+    final_snapshot = await graph.aget_state(config)
     for msg in final_snapshot.values.get("messages", []):
-        if "[Subgraph Researcher]" in msg.content:
-            print(f"🕵️  {msg.content}")
-        elif "[Subgraph Writer]" in msg.content:
-            print(f"✍️  {msg.content}")
-        elif "EDITOR" in msg.content:
-            print(f"👔 {msg.content}")
-        else:
-            print(f"👤 {msg.content}")
+        icon = ROLE_ICONS.get(msg.additional_kwargs.get("role", msg.type), "🤖")
+        print(f"{icon} {msg.content}")
         print("-" * 60)
 
-def main():
+def _build_parent_builder():
     # 构建父图
     builder = StateGraph(SuperGraphState)
     builder.add_node("researcher", research_node)
-    builder.add_node("writer", writing_node)
+    builder.add_node("speculative_planner", speculative_planner_node)
+    builder.add_node("writer_workers", writer_workers_node)
     builder.add_node("publisher", publisher_node)
     
+    # Fan-out: researcher 与 speculative_planner 在同一个 superstep 并行执行
     builder.add_edge(START, "researcher")
-    builder.add_edge("researcher", "writer")
-    builder.add_edge("writer", "publisher")
+    builder.add_edge(START, "speculative_planner")
+    # Join: 两者都完成后才进入 writer_workers
+    builder.add_edge(["researcher", "speculative_planner"], "writer_workers")
+    builder.add_edge("writer_workers", "publisher")
     builder.add_edge("publisher", END)
+    return builder
+
+# 与子图一样，父图结构只在模块加载时构建一次；checkpointer 依赖运行时打开的连接，所以 compile 留到 run_demo
+PARENT_BUILDER = _build_parent_builder()
+
+async def main():
+    # Checkpointer: 与 04 一样用 SQLite 落盘 (WAL + synchronous=NORMAL)
+    # 每个 Send 出去的并行任务一完成，LangGraph 就单独调用一次 aput_writes (N 个 Worker = N 次写事务)；
+    # CoalescingAsyncSqliteSaver 把 50ms 内的写入合并成一次事务，下一次写 checkpoint 前也会先落盘
+    async with aiosqlite.connect("tutorials/checkpoints/07_hybrid.sqlite", isolation_level=None) as conn:
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        checkpointer = CoalescingAsyncSqliteSaver(conn)
+        try:
+            await run_demo(checkpointer)
+        finally:
+            # 退出前把缓冲里剩下的写入落盘
+            await checkpointer.aflush()
+
+async def run_demo(checkpointer):
+    super_graph = PARENT_BUILDER.compile(checkpointer=checkpointer)
     
-    super_graph = builder.compile(checkpointer=MemorySaver())
-    
-    # 可视化
-    visualize_graph(super_graph, "07_hybrid_parent.png")
-    visualize_graph(writing_graph, "07_hybrid_child_writer.png")
-    visualize_graph(research_graph, "07_hybrid_child_researcher.png")
+    # 可视化: 三张图互不依赖 (各写各的文件)，渲染主要在等 mermaid.ink 的网络请求，
+    # 放到线程里并行，总耗时取决于最慢的一张
+    await asyncio.gather(
+        asyncio.to_thread(visualize_graph, super_graph, "07_hybrid_parent.png"),
+        asyncio.to_thread(visualize_graph, get_writing_graph(), "07_hybrid_child_writer.png"),
+        asyncio.to_thread(visualize_graph, research_graph, "07_hybrid_child_researcher.png"),
+    )
     
     # 运行
-    config = {"configurable": {"thread_id": "hybrid_demo"}}
+    # 数据库跨运行保留，每次运行用新的 thread，避免和上一次的 messages 混在一起
+    config = {"configurable": {"thread_id": str(uuid7())}}
     user_input = "The future of AI Agents"
     
     print(f"User Request: {user_input}")
     
-    super_graph.invoke(
+    await super_graph.ainvoke(
         {"user_topic": user_input, "messages": [HumanMessage(content=user_input)]},
         config=config
     )
     
     # 打印最终结果
-    state = super_graph.get_state(config).values
+    state = (await super_graph.aget_state(config)).values
     print("\n" + "="*40)
     print("📰 FINAL ARTICLE PREVIEW:")
     print(state["final_article"])
     
     # 打印审计
-    print_audit_log(super_graph, config)
+    await print_audit_log(super_graph, config)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
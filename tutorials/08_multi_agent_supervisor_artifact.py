@@ -7,18 +7,19 @@
 # ]
 # ///
 
-import operator
-from typing import TypedDict, Annotated, List, Literal, Union, Optional
+import functools
+import hashlib
+from typing import TypedDict, Annotated, List
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
 
 from langgraph.graph import StateGraph, START, END
-from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
 
 from utils.visualizer import visualize_graph
+from utils.llm import get_llm
+from utils.reducers import bounded_messages
 
 load_dotenv()
 
@@ -26,23 +27,28 @@ load_dotenv()
 # 1. State Definitions (Artifact-Centric)
 # ==========================================
 
+# 审计日志只保留最近 50 条：checkpoint 大小不随迭代轮数增长 (6 轮迭代实际用不满这个窗口)
+MAX_AUDIT_MESSAGES = 50
+
 class AgentState(TypedDict):
     # --- 核心工单字段 (Single Source of Truth) ---
     request: str                # 原始需求
     code: str                   # 当前版本的代码
     review: str                 # 当前版本的评审意见
     revision_number: int        # 迭代次数 (防止死循环)
+    code_hash: str              # 当前版本代码的指纹
+    prev_code_hash: str         # 上一版本代码的指纹 (两者相同说明 Coder 原地踏步)
     
     # --- 控制流字段 ---
     next: str                   # 下一步是谁
     
     # --- 审计日志字段 (仅供人类阅读，Worker 不依赖此字段干活) ---
-    messages: Annotated[List[BaseMessage], add_messages]
+    messages: Annotated[List[BaseMessage], bounded_messages(MAX_AUDIT_MESSAGES)]
 
 # ==========================================
 # 2. Worker Nodes (Stateless & Focused)
 # ==========================================
-llm_worker = ChatOpenAI(model="gpt-4.1-nano", temperature=0.5)
+llm_worker = get_llm("gpt-4.1-nano", 0.5)
 
 def coder_node(state: AgentState):
     """
@@ -82,8 +88,10 @@ def coder_node(state: AgentState):
     return {
         "code": new_code,
         "revision_number": revision + 1,
+        "code_hash": hashlib.blake2b(new_code.encode(), digest_size=8).hexdigest(),
+        "prev_code_hash": state.get("code_hash", ""),
         # 记录到审计日志
-        "messages": [AIMessage(content=f"[Coder]: Code generated (Rev {revision + 1})")]
+        "messages": [AIMessage(content=f"[Coder]: Code generated (Rev {revision + 1})", additional_kwargs={"role": "coder"})]
     }
 
 def reviewer_node(state: AgentState):
@@ -118,7 +126,7 @@ def reviewer_node(state: AgentState):
     return {
         "review": review_content,
         # 记录到审计日志
-        "messages": [AIMessage(content=f"[Reviewer]: {review_content}")]
+        "messages": [AIMessage(content=f"[Reviewer]: {review_content}", additional_kwargs={"role": "reviewer"})]
     }
 
 # ==========================================
@@ -136,12 +144,18 @@ def supervisor_node(state: AgentState):
         decision = "FINISH"
         log_msg = "✅ [Supervisor]: Code approved (LGTM). Task completed."
     
-    # 2. 判断是否超限 (Safety Guard)
+    # 2. 判断是否原地踏步 (No Progress): 按同一份评审意见改完，代码却一字未变，
+    #    再送去 Review 只会得到同样的意见，直接结束，省掉后续的 Reviewer/Coder 调用
+    elif revision > 1 and state.get("code_hash") == state.get("prev_code_hash"):
+        decision = "FINISH"
+        log_msg = "⚠️ [Supervisor]: Coder made no changes since the last review. Stopping."
+    
+    # 3. 判断是否超限 (Safety Guard)
     elif revision >= 6:
         decision = "FINISH"
         log_msg = "⚠️ [Supervisor]: Max revisions reached. Stopping to prevent infinite loop."
     
-    # 3. 路由逻辑 (Routing Logic)
+    # 4. 路由逻辑 (Routing Logic)
     else:
         # 如果最近一次是由 Reviewer 发言（且不是 LGTM），那肯定得让 Coder 改
         # 如果是刚开始（revision=0）或者刚写完没 review，这里我们需要一个状态机逻辑
@@ -153,13 +167,13 @@ def supervisor_node(state: AgentState):
         # 简单判定：如果 code 存在，且 review 是空的(或者是上一轮的旧 review)，去 Reviewer。
         # 但因为我们每次都覆盖 update review，比较难判断是"旧"的还是"新"的。
         
-        # 更简单的做法：查看 messages 里的最后一条消息是谁发的
-        last_msg = state["messages"][-1] if state["messages"] else None
+        # 更简单的做法：查看 messages 里的最后一条消息是谁发的 (看角色标签，不扫描内容)
+        last_role = state["messages"][-1].additional_kwargs.get("role") if state["messages"] else None
         
-        if last_msg and "[Coder]" in last_msg.content:
+        if last_role == "coder":
             decision = "Reviewer"
             log_msg = "👉 [Supervisor]: New code detected. Assigning to Reviewer."
-        elif last_msg and "[Reviewer]" in last_msg.content:
+        elif last_role == "reviewer":
             decision = "Coder"
             log_msg = "👉 [Supervisor]: Issues found. Assigning back to Coder."
         else:
@@ -171,13 +185,15 @@ def supervisor_node(state: AgentState):
     
     return {
         "next": decision,
-        "messages": [AIMessage(content=log_msg)]
+        "messages": [AIMessage(content=log_msg, additional_kwargs={"role": "supervisor"})]
     }
 
 # ==========================================
 # 4. Graph Construction
 # ==========================================
-def main():
+# 只构建/编译一次；缓存的图共享同一个 Checkpointer
+@functools.lru_cache(maxsize=1)
+def build_graph():
     builder = StateGraph(AgentState)
     
     builder.add_node("supervisor", supervisor_node)
@@ -202,7 +218,10 @@ def main():
         }
     )
     
-    graph = builder.compile(checkpointer=MemorySaver())
+    return builder.compile(checkpointer=MemorySaver())
+
+def main():
+    graph = build_graph()
     visualize_graph(graph, "08_supervisor_optimized_2.png")
 
     # ==========================================
@@ -249,6 +268,17 @@ def main():
     
     print_audit_log(graph, config)
 
+# 审计日志: 按节点写入的 additional_kwargs["role"] 查表，没有标签的按消息类型兜底
+ROLE_ICONS = {
+    "human": ("User", "👤"),
+    # Coder 的消息我们只记录了一个占位符，如果想看代码，可以打印 state['code']
+    "coder": ("Coder", "💻"),
+    "reviewer": ("Reviewer", "🔍"),
+    "supervisor": ("Supervisor", "👮"),
+    "ai": ("AI", "🤖"),
+}
+UNKNOWN_ROLE = ("Unknown", "❓")
+
 def print_audit_log(graph, config):
     print("\n" + "="*60)
     print("📜  FULL CONVERSATION HISTORY (AUDIT LOG)")
@@ -256,30 +286,12 @@ def print_audit_log(graph, config):
     final_snapshot = graph.get_state(config)
     
     for msg in final_snapshot.values.get("messages", []):
-        icon = "❓"
-        role = "Unknown"
+        role_key = msg.additional_kwargs.get("role", msg.type)
+        role, icon = ROLE_ICONS.get(role_key, UNKNOWN_ROLE)
         content = msg.content
-        
-        if isinstance(msg, HumanMessage):
-            icon = "👤"
-            role = "User"
-        elif isinstance(msg, AIMessage):
-            if "[Coder]" in content:
-                icon = "💻"
-                role = "Coder"
-                # Coder 的消息我们只记录了一个占位符，如果想看代码，可以打印 state['code']
-                # 但为了日志整洁，这里保持原样
-            elif "[Reviewer]" in content:
-                icon = "🔍"
-                role = "Reviewer"
-                # 如果内容太长，截断显示
-                if len(content) > 1000: content = content[:1000] + "..."
-            elif "[Supervisor]" in content:
-                icon = "👮"
-                role = "Supervisor"
-            else:
-                icon = "🤖"
-                role = "AI"
+        # Reviewer 的内容太长时截断显示
+        if role_key == "reviewer" and len(content) > 1000:
+            content = content[:1000] + "..."
         
         print(f"{icon}  [{role}]: {content}")
         print("-" * 60)
@@ -7,19 +7,18 @@
 # ]
 # ///
 
-import operator
-from typing import TypedDict, Annotated, List, Literal, Union
+import functools
+from typing import TypedDict, Annotated, List
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
-from pydantic import BaseModel, Field
 
 from langgraph.graph import StateGraph, START, END
-from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
 
 from utils.visualizer import visualize_graph
+from utils.llm import get_llm
+from utils.reducers import bounded_messages
 
 load_dotenv()
 
@@ -27,48 +26,46 @@ load_dotenv()
 # 1. State Definitions
 # ==========================================
 
+# 审计日志只保留最近 50 条：checkpoint 大小不随迭代轮数增长 (Supervisor 只看最后一条)
+MAX_AUDIT_MESSAGES = 50
+
 # 我们需要一个字段来存储"下一个是谁"
 class AgentState(TypedDict):
-    messages: Annotated[List[BaseMessage], add_messages] # 一长串聊天记录 Chat 模式
+    # Worker 只读这三个字段，Prompt 长度不随迭代轮数增长
+    request: str            # 原始需求
+    code: str               # 当前版本的代码
+    review: str             # 当前版本的评审意见
+    messages: Annotated[List[BaseMessage], bounded_messages(MAX_AUDIT_MESSAGES)] # 一长串聊天记录 Chat 模式 (仅供审计，Worker 不读)
     next: str
+    revision_number: int    # Coder 已经交付的版本数 (防止死循环)
 
 # ==========================================
-# 2. The Supervisor (The Brain)
+# 2. The Supervisor (Logic-Based Router)
 # ==========================================
-llm_supervisor = ChatOpenAI(model="gpt-4.1-nano", temperature=0)
-
-# 定义 Supervisor 的可选输出
-# 这就是"路由表"，LLM 必须从中选一个
-members = ["Coder", "Reviewer"]
-options = ["FINISH"] + members
-
-# 使用结构化输出强制 LLM 做选择
-class RouteResponse(BaseModel):
-    next: Literal["FINISH", "Coder", "Reviewer"] = Field(
-        description="Who should act next? Select 'FINISH' if the task is complete."
-    )
+# 路由只有三个固定出口，用 LLM 来选等于每一跳多一次网络往返；
+# 和 artifact 版本一样，直接看最后一条消息是谁发的即可 (纯 Python 状态机)。
+# 如果以后路由真的需要 LLM 判断，也不必用 with_structured_output (function calling)：
+# 让模型只输出一个字母 (C/R/F)，配合 max_tokens=1 + logit_bias 限定候选 token 即可。
+MAX_REVISIONS = 6
 
 def supervisor_node(state: AgentState):
     """
     主管节点：只负责观察历史，决定下一步去哪里。
     """
-    print("--- [Supervisor] Thinking... ---")
-    
-    system_prompt = (
-        "You are a supervisor managing a conversation between the following workers: "
-        f"{members}. Given the following user request, respond with the worker to act next. "
-        "Each worker will perform a task and respond with their results and status. "
-        "When finished, respond with FINISH."
-    )
-    
-    # 构造 Prompt，包含完整的历史记录
-    messages = [SystemMessage(content=system_prompt)] + state["messages"]
-    
-    # 使用 with_structured_output 强制输出 JSON
-    structured_llm = llm_supervisor.with_structured_output(RouteResponse)
-    response = structured_llm.invoke(messages)
-    
-    next_agent = response.next
+    last_msg = state["messages"][-1] if state["messages"] else None
+    last_role = last_msg.additional_kwargs.get("role") if last_msg else None
+
+    if last_role == "reviewer" and "LGTM" in state.get("review", ""):
+        next_agent = "FINISH"
+    elif state.get("revision_number", 0) >= MAX_REVISIONS:
+        # 安全阀: 超过最大版本数就停止，避免 Coder <-> Reviewer 无限循环
+        next_agent = "FINISH"
+    elif last_role == "coder":
+        next_agent = "Reviewer"
+    else:
+        # 刚开始 (最后一条是用户消息) 或 Reviewer 要求修改
+        next_agent = "Coder"
+
     print(f"--- [Supervisor] Route -> {next_agent} ---")
     
     # 我们不往 messages 里写 Supervisor 的决策过程，只更新 'next' 字段
@@ -78,28 +75,37 @@ def supervisor_node(state: AgentState):
 # ==========================================
 # 3. The Workers (Coder & Reviewer)
 # ==========================================
-llm_worker = ChatOpenAI(model="gpt-4o-mini", temperature=0.7)
+llm_worker = get_llm("gpt-4o-mini", 0.7)
 
 def coder_node(state: AgentState):
     """写代码的工人"""
     print("  -> [Coder] Working...")
     
+    # 不再把整段聊天记录发给 LLM：只带需求、上一版代码和最新评审意见
     messages = [
         SystemMessage(content=(
             "You are a Python Coder. "
             "Write code to solve the user's problem. "
+            "If previous code and reviewer feedback are given, fix the issues in that code. "
             "Return the code in a markdown block (```python ... ```). "
             # [核心修改]: 明确禁止它做 Review
             "IMPORTANT: Do NOT review the code yourself. Do NOT explain the code. "
             "Just output the code block. Another agent will review it."
         )),
-    ] + state["messages"]
+        HumanMessage(content=(
+            f"REQUEST:\n{state['request']}\n\n"
+            f"PREVIOUS CODE:\n{state.get('code') or 'None'}\n\n"
+            f"REVIEWER FEEDBACK:\n{state.get('review') or 'None'}"
+        )),
+    ]
     
     response = llm_worker.invoke(messages)
     
-    # 加上前缀方便审计
+    # 加上前缀方便阅读；role 标签供 Supervisor 判断上一跳是谁、供审计日志查表
     return {
-        "messages": [AIMessage(content=f"[Coder]: {response.content}")]
+        "code": response.content,
+        "messages": [AIMessage(content=f"[Coder]: {response.content}", additional_kwargs={"role": "coder"})],
+        "revision_number": state.get("revision_number", 0) + 1,
     }
 
 def reviewer_node(state: AgentState):
@@ -108,18 +114,22 @@ def reviewer_node(state: AgentState):
     
     messages = [
         SystemMessage(content="You are a Code Reviewer. Check the Coder's code. If it looks good, say 'LGTM'. If not, ask for changes."),
-    ] + state["messages"]
+        HumanMessage(content=f"REQUEST:\n{state['request']}\n\nCODE TO REVIEW:\n{state['code']}"),
+    ]
     
     response = llm_worker.invoke(messages)
     
     return {
-        "messages": [AIMessage(content=f"[Reviewer]: {response.content}")]
+        "review": response.content,
+        "messages": [AIMessage(content=f"[Reviewer]: {response.content}", additional_kwargs={"role": "reviewer"})]
     }
 
 # ==========================================
 # 4. Graph Construction
 # ==========================================
-def main():
+# 只构建/编译一次；缓存的图共享同一个 Checkpointer
+@functools.lru_cache(maxsize=1)
+def build_graph():
     builder = StateGraph(AgentState)
     
     # 添加节点
@@ -146,7 +156,10 @@ def main():
         }
     )
     
-    graph = builder.compile(checkpointer=MemorySaver())
+    return builder.compile(checkpointer=MemorySaver())
+
+def main():
+    graph = build_graph()
     visualize_graph(graph, "08_supervisor.png")
 
     # ==========================================
@@ -160,10 +173,12 @@ def main():
     
     # 运行图
     # event 的格式通常是: {'node_name': {'key': 'value'}}
+    # 每一版代码要走 supervisor -> Coder -> supervisor -> Reviewer 共 4 个 superstep，
+    # recursion_limit 按 MAX_REVISIONS 推出来，保证安全阀能先于 GraphRecursionError 生效
     for event in graph.stream(
-        {"messages": [HumanMessage(content=user_query)]}, 
+        {"request": user_query, "messages": [HumanMessage(content=user_query)]}, 
         config=config, 
-        recursion_limit=20
+        recursion_limit=4 * MAX_REVISIONS + 2
     ):
         for node_name, state_update in event.items():
             # 1. 捕获 Supervisor 的决策
@@ -187,28 +202,24 @@ def main():
         
     print_audit_log(graph, config)
 
+# 审计日志: 按节点写入的 additional_kwargs["role"] 查表，没有标签的按消息类型兜底
+ROLE_ICONS = {
+    "human": ("User", "👤"),
+    "coder": ("Coder", "💻"),
+    "reviewer": ("Reviewer", "🔍"),
+}
+
 def print_audit_log(graph, config):
     print("\n" + "="*60)
     print("📜  FULL CONVERSATION HISTORY (AUDIT LOG)")
     print("="*60)
     final_snapshot = graph.get_state(config)
     for msg in final_snapshot.values.get("messages", []):
-        icon = "👤"
-        role = "User"
-        if isinstance(msg, AIMessage):
-            if "[Coder]" in msg.content:
-                icon = "💻"
-                role = "Coder"
-                msg.content = msg.content.replace("[Coder]: ", "")
-            elif "[Reviewer]" in msg.content:
-                icon = "🔍"
-                role = "Reviewer"
-                msg.content = msg.content.replace("[Reviewer]: ", "")
-            else:
-                icon = "🤖"
-                role = "AI"
+        role, icon = ROLE_ICONS.get(msg.additional_kwargs.get("role", msg.type), ("AI", "🤖"))
+        # 角色已经单独显示，去掉内容里的 "[Coder]: " 之类的前缀
+        content = msg.content.removeprefix(f"[{role}]: ")
         
-        print(f"{icon} [{role}]: {msg.content[:500]}...") # 只打印前500字避免刷屏
+        print(f"{icon} [{role}]: {content[:500]}...") # 只打印前500字避免刷屏
         print("-" * 60)
 
 if __name__ == "__main__":
@@ -7,13 +7,13 @@
 # ]
 # ///
 
+import asyncio
+import re
 import uuid
-from typing import TypedDict, Annotated, List, Literal, Optional
+from typing import TypedDict, Annotated, List, Optional, Tuple
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
-from pydantic import BaseModel, Field
 
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
@@ -22,6 +22,7 @@ from langgraph.checkpoint.memory import MemorySaver
 from langgraph.types import Command
 
 from utils.visualizer import visualize_graph
+from utils.llm import get_llm
 
 load_dotenv()
 
@@ -33,57 +34,100 @@ Handoff (接力)
 # 1. State Definitions
 # ==========================================
 class AgentState(TypedDict):
+    # add_messages: 节点只返回本次新增的消息 (如 [ai_msg, system_notice])，由 reducer 追加，
+    # 不要在节点里返回整份历史
     messages: Annotated[List[BaseMessage], add_messages]
     active_agent: str # 记录当前拿着"接力棒"的人
 
 # ==========================================
-# 2. Decision Schemas (替代 Tools)
+# 2. Decision Protocol (替代 Tools)
 # ==========================================
-# 让 LLM 直接做选择题，而不是调用工具
+# 让 LLM 直接做选择题，而不是调用工具。
+# 大部分轮次只是普通回复，不需要为此走 with_structured_output (function calling + JSON Schema)；
+# 约定回复的第一行写决策，纯文本解析即可：
+#   TRANSFER:<agent>   -> 转接，后面几行是给用户的话
+#   REPLY:<text>       -> 自己回复
+AGENTS = {"triage", "tech_support"}
 
-class Response(BaseModel):
-    """每个 Agent 的标准输出结构"""
-    response_text: str = Field(description="The response to show to the user.")
-    next_step: Literal["reply_to_user", "transfer"] = Field(
-        description="Choose 'transfer' if you need to handoff to another agent, otherwise 'reply_to_user'."
-    )
-    transfer_target: Optional[Literal["triage", "tech_support"]] = Field(
-        description="Only required if next_step is 'transfer'. The name of the agent to transfer to.",
-        default=None
-    )
+DECISION_FORMAT = (
+    "\n\nFormat your answer as follows. To reply to the user yourself, start with 'REPLY:' "
+    "followed by your response. To hand off, write 'TRANSFER:<agent>' (agent is 'triage' or "
+    "'tech_support') on the first line, then a short message to the user on the next line."
+)
+
+def parse_decision(text: str) -> Tuple[str, Optional[str]]:
+    """把 LLM 输出解析成 (给用户的回复, 转接目标或 None)"""
+    first_line, _, rest = text.strip().partition("\n")
+    kind, _, value = first_line.partition(":")
+    kind = kind.strip().upper()
+
+    if kind == "TRANSFER" and value.strip() in AGENTS:
+        return rest.strip() or "Transferring you now.", value.strip()
+    if kind == "REPLY":
+        return (value + "\n" + rest).strip(), None
+    # 没按格式输出时，整段都当作普通回复
+    return text.strip(), None
+
+# 关键词快速通道: 意图一目了然的句子 (报错、账单) 不必问 LLM，直接转接；拿不准的才交给 LLM
+# 不收 "error"、"code" 这种泛词: "There's an error on my invoice"、"promo code" 都是账单问题
+TECH_RE = re.compile(r"\b(bug|segfault|stack ?trace|exception|crash|compile)\b", re.I)
+BILLING_RE = re.compile(
+    r"\b(bill|billing|invoice|refund|payment|charge[ds]?|promo|discount|coupon|subscription|price|plan)\b", re.I
+)
+
+def keyword_match(state, pattern: re.Pattern, other: re.Pattern) -> bool:
+    """
+    只看用户刚发的这句话，且只有命中 pattern、同时不命中 other 时才算数。
+    两边都命中的句子意图不明确，交给 LLM 判断，否则会在两个 Agent 之间来回转接；
+    最后一条不是 HumanMessage (别的 Agent 刚转接过来) 时同理不走快速通道。
+    """
+    last = state["messages"][-1] if state["messages"] else None
+    if not isinstance(last, HumanMessage):
+        return False
+    return bool(pattern.search(last.content)) and not other.search(last.content)
 
 # ==========================================
 # 3. Agents (Nodes)
 # ==========================================
 # 这里 4.1 nano 和 4o mini 都有幻觉，最后回不到前台
 # 4o 最后会回到前台
-llm = ChatOpenAI(model="gpt-4.1-nano", temperature=0)
-# llm = ChatOpenAI(model="gpt-4o", temperature=0)
+llm = get_llm("gpt-4.1-nano", 0, cached=True)
+# llm = get_llm("gpt-4o", 0, cached=True)
 
-def triage_node(state: AgentState):
+# System Prompt 是固定的，模块加载时构造一次，各轮调用共用同一个 SystemMessage
+TRIAGE_SYSTEM = SystemMessage(content=(
+    "You are 'Triage', the front desk support. You handle billing questions. "
+    "If the user has a technical issue (code, bugs), you MUST transfer to 'tech_support'. "
+    "Otherwise, reply to the user yourself."
+    + DECISION_FORMAT
+))
+TECH_SUPPORT_SYSTEM = SystemMessage(content=(
+    "You are 'Tech Support'. You solve coding issues. "
+    "When the issue is resolved, or if the user asks about billing, transfer back to 'triage'. "
+    "Otherwise, reply to the user."
+    + DECISION_FORMAT
+))
+
+async def triage_node(state: AgentState):
     """前台接待：处理账单，转接技术"""
     print("  -> [Triage] Processing...")
     
     # 1. 构造 Prompt
-    system_msg = SystemMessage(content=(
-        "You are 'Triage', the front desk support. You handle billing questions. "
-        "If the user has a technical issue (code, bugs), you MUST transfer to 'tech_support'. "
-        "Otherwise, reply to the user yourself."
-    ))
-    messages = [system_msg] + state["messages"]
+    messages = [TRIAGE_SYSTEM, *state["messages"]]
     
-    # 2. 获取结构化决策 (不涉及工具调用，纯逻辑判断)
-    structured_llm = llm.with_structured_output(Response)
-    decision = structured_llm.invoke(messages)
+    # 2. 获取决策 (不涉及工具调用，纯文本解析)；明显的技术问题直接转接，省掉一次 LLM 调用
+    if keyword_match(state, TECH_RE, BILLING_RE):
+        response_text, target = "Let me transfer you to Tech Support.", "tech_support"
+    else:
+        response_text, target = parse_decision((await llm.ainvoke(messages)).content)
     
     # 3. 生成回复消息
-    ai_msg = AIMessage(content=f"[Triage]: {decision.response_text}")
+    ai_msg = AIMessage(content=f"[Triage]: {response_text}")
     
     # ============================================================
     # 4. Command Logic (核心跳转)
     # ============================================================
-    if decision.next_step == "transfer" and decision.transfer_target:
-        target = decision.transfer_target
+    if target:
         print(f"  🔄 Handoff: Triage -> {target}")
         
         # 注入一条系统消息，告诉下一棒发生了什么 (Context Passing)
@@ -104,25 +148,22 @@ def triage_node(state: AgentState):
     )
 
 
-def tech_support_node(state: AgentState):
+async def tech_support_node(state: AgentState):
     """技术支持：修 Bug，修好转回前台"""
     print("  -> [Tech Support] Debugging...")
     
-    system_msg = SystemMessage(content=(
-        "You are 'Tech Support'. You solve coding issues. "
-        "When the issue is resolved, or if the user asks about billing, transfer back to 'triage'. "
-        "Otherwise, reply to the user."
-    ))
-    messages = [system_msg] + state["messages"]
+    messages = [TECH_SUPPORT_SYSTEM, *state["messages"]]
     
-    structured_llm = llm.with_structured_output(Response)
-    decision = structured_llm.invoke(messages)
+    # 明显的账单问题直接转回前台
+    if keyword_match(state, BILLING_RE, TECH_RE):
+        response_text, target = "Let me transfer you back to the front desk for billing.", "triage"
+    else:
+        response_text, target = parse_decision((await llm.ainvoke(messages)).content)
     
-    ai_msg = AIMessage(content=f"[Tech]: {decision.response_text}")
+    ai_msg = AIMessage(content=f"[Tech]: {response_text}")
     
     # Command Logic
-    if decision.next_step == "transfer" and decision.transfer_target:
-        target = decision.transfer_target
+    if target:
         print(f"  🔄 Handoff: Tech Support -> {target}")
         
         system_notice = SystemMessage(content=f"SYSTEM: User transferred from Tech Support.")
@@ -156,21 +197,24 @@ def entry_router(state: AgentState):
     机制：Router 醒来后的第一件事，就是去读取内存（Memory）里的 active_agent 字段。
     - 如果 active_agent="tech_support"，Router 说：“哦，上次是 Tech 在服务，那我把这通电话直接转给 Tech。”
     - 日志证据：--- Router: Dispatching to tech_support ---，此时 Triage 根本不会被唤醒。
+    
+    它只读一个字段、不调 LLM，所以挂在 START 的条件边上，而不是单独占一个节点：
+    每轮少跑一个 superstep，也少写一次 checkpoint。
     """
     active = state.get("active_agent", "triage") # 默认给前台
     print(f"--- Router: Dispatching to {active} ---")
-    return Command(goto=active)
+    return active
 
 # ==========================================
 # 5. Graph Construction
 # ==========================================
-def main():
+async def main():
     """
     总结：这种架构叫 "Star Graph" (星型图)
     在这个架构下，图结构非常简单：
     1. 中心是 Entry Router。
     2. 周围是 Agents (Triage, Tech, Sales...)。
-    3. Edge: 只有 START -> Router 这一条显式的边。
+    3. Edge: 只有 START -> (Router) -> Agent 这一条显式的条件边。
     4. Jumps: 所有的 Agent 都可以通过 Command 任意跳到其他 Agent（网状跳转），而不需要在图里画几十条线。
 
     这就是构建 OpenAI Swarm 风格多智能体系统的标准范式！
@@ -184,12 +228,11 @@ def main():
     """
     builder = StateGraph(AgentState)
     
-    builder.add_node("entry", entry_router)
     builder.add_node("triage", triage_node)
     builder.add_node("tech_support", tech_support_node)
     
-    # 只有这一个显式的 Edge
-    builder.add_edge(START, "entry")
+    # 只有这一个显式的 (条件) Edge
+    builder.add_conditional_edges(START, entry_router, ["triage", "tech_support"])
     
     # 注意：我们完全删除了所有的 add_edge(node, node)
     # 所有的连接都是隐式的，由 Command 动态生成
@@ -209,22 +252,23 @@ def main():
         "Thanks! Can you check my bill now?",            # Tech -> Triage
     ]
     
+    final_state = {}
     for i, txt in enumerate(user_inputs):
         print(f"\n🗣️  User ({i+1}): {txt}")
         
         # 运行图
-        for event in graph.stream({"messages": [HumanMessage(content=txt)]}, config=config):
+        # 同时订阅 "values": 最后一个 values 事件就是本轮结束时的完整 State，
+        # 跑完后不用再向 Checkpointer 查询一次 get_state
+        async for mode, event in graph.astream(
+            {"messages": [HumanMessage(content=txt)]},
+            config=config,
+            stream_mode=["updates", "values"],
+        ):
+            if mode == "values":
+                final_state = event
+                continue
             
             for node_name, update in event.items():
-                
-                # [关键修复]: 防御性编程
-                # entry 节点返回 Command(goto=...) 但没有 update，所以 update 是 None
-                if update is None:
-                    if node_name == "entry":
-                        print(f"  🚦 [Entry Router]: Switching line...")
-                    else:
-                        print(f"  ⏩ [{node_name}]: Pure jump (No state update)")
-                    continue
 
                 # --- 1. 捕捉 Handoff (控制权转移) ---
                 if "active_agent" in update:
@@ -248,14 +292,13 @@ def main():
                         print(f"     [Context Injection]: {last_msg.content}")
              
     # 打印最终历史
-    print_audit_log(graph, config)
+    print_audit_log(final_state)
 
-def print_audit_log(graph, config):
+def print_audit_log(state):
     print("\n" + "="*60)
     print("📜  FULL HISTORY")
     print("="*60)
-    state = graph.get_state(config)
-    for msg in state.values.get("messages", []):
+    for msg in state.get("messages", []):
         if isinstance(msg, AIMessage):
             print(f"🤖 {msg.content}")
         elif isinstance(msg, HumanMessage):
@@ -263,7 +306,7 @@ def print_audit_log(graph, config):
         elif isinstance(msg, SystemMessage):
             print(f"⚙️ {msg.content}")
     print("-" * 60)
-    print(f"Final Active Agent: {state.values.get('active_agent')}")
+    print(f"Final Active Agent: {state.get('active_agent')}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
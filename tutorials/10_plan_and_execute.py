@@ -26,16 +26,17 @@ Re-Planner (工头/监理): 每天干完活来检查。根据进度调整计划
 ❌ Cons: 慢 & 贵（步骤多，LLM调用次数多）、上下文堆积（Prompt 越来越长）。
 """
 
+import asyncio
 import operator
 from typing import Annotated, List, Tuple, TypedDict, Optional
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
 
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
 
 from langgraph.graph import StateGraph, START, END
 from utils.visualizer import visualize_graph
+from utils.llm import get_llm
 
 load_dotenv()
 
@@ -46,8 +47,12 @@ load_dotenv()
 class PlanExecuteState(TypedDict):
     input: str                          # 原始大目标
     plan: List[str]                     # 待执行的任务栈
+    # plan[i] 依赖的步骤下标 (指向 plan 内)；None 表示没有依赖信息，按顺序逐个执行
+    dependencies: Optional[List[List[int]]]
     # 核心：记录历史步骤 [(Step Name, Result Content), ...]
     past_steps: Annotated[List[Tuple[str, str]], operator.add] 
+    # past_steps 的文本形式，Executor 每次只追加本轮新增的步骤，不必每次从头重新拼接历史
+    context: Annotated[str, operator.add]
     response: Optional[str]             # 最终答案
 
 # ==========================================
@@ -57,6 +62,13 @@ class PlanExecuteState(TypedDict):
 class Plan(BaseModel):
     """Planner 的产出"""
     steps: List[str] = Field(description="List of steps to follow, in order.")
+    dependencies: Optional[List[List[int]]] = Field(
+        default=None,
+        description=(
+            "For each step, the 0-based indices of earlier steps whose results it needs. "
+            "Use [] for steps that can run independently."
+        ),
+    )
 
 class Response(BaseModel):
     """Re-Planner 的产出"""
@@ -68,8 +80,21 @@ class Response(BaseModel):
 # ==========================================
 
 # 用更小的模型有幻觉，会丢上下文，丢步骤
-llm = ChatOpenAI(model="gpt-4.1-nano", temperature=0)
-# llm = ChatOpenAI(model="gpt-4o", temperature=0)
+llm = get_llm("gpt-4.1-nano", 0, cached=True)
+# llm = get_llm("gpt-4o", 0, cached=True)
+
+# 结构化输出的 Runnable 只需要构建一次，不必每次进入节点都重新绑定 schema
+planner_llm = llm.with_structured_output(Plan)
+# Re-Planner 用 OpenAI 原生 Structured Outputs (json_schema + strict)：服务端按 schema 约束解码，
+# 返回的 JSON 一定合法，不会出现缺字段/解析失败再重试的情况
+replanner_llm = llm.with_structured_output(Response, method="json_schema", strict=True)
+
+# 固定的 System Prompt 在模块加载时构造一次，各节点调用共用
+PLANNER_SYSTEM = SystemMessage(content=(
+    "For the given objective, come up with a simple step-by-step plan. "
+    "The result of the final step should be the final answer. "
+    "Also list, for each step, which earlier steps it depends on."
+))
 
 def planner_node(state: PlanExecuteState):
     """
@@ -79,84 +104,85 @@ def planner_node(state: PlanExecuteState):
     """
     print(f"--- [Planner] Strategizing for: {state['input']} ---")
     
-    planner_llm = llm.with_structured_output(Plan)
-    prompt = (
-        "For the given objective, come up with a simple step-by-step plan. "
-        "The result of the final step should be the final answer."
-    )
-    
     plan = planner_llm.invoke([
-        SystemMessage(content=prompt),
+        PLANNER_SYSTEM,
         HumanMessage(content=state["input"])
     ])
     
     print(f"📋 Initial Plan: {plan.steps}")
     # 初始化 Plan
-    return {"plan": plan.steps}
+    return {"plan": plan.steps, "dependencies": plan.dependencies}
+
+def ready_tasks(state: PlanExecuteState) -> List[str]:
+    """
+    找出依赖已全部完成的步骤 (DAG 的当前前沿)。
+    没有依赖信息、依赖表和计划对不上、或依赖有环时，退回到只执行 plan[0]。
+    """
+    plan = state["plan"]
+    dependencies = state.get("dependencies")
+    if not dependencies or len(dependencies) != len(plan):
+        return plan[:1]
 
-def executor_node(state: PlanExecuteState):
+    done = {step for step, _ in state["past_steps"]}
+    ready = [
+        task for task, deps in zip(plan, dependencies)
+        if task not in done and all(plan[d] in done for d in deps if 0 <= d < len(plan) and plan[d] != task)
+    ]
+    return ready or plan[:1]
+
+EXECUTOR_SYSTEM = SystemMessage(content=(
+    "You are a helpful worker. "
+    "Execute the following task to the best of your ability."
+    "Use the provided context if necessary to complete the task."
+    "Provide a concise result."
+))
+
+async def executor_node(state: PlanExecuteState):
     """
     Node 2: Executor (执行者)
-    作用: 从任务栈顶取出一个 task 执行。
+    作用: 取出当前所有可执行的 task (互不依赖的步骤) 一起执行。
     State Continuity: 必须把“历史记忆” (past_steps) 传给当前操作者，否则它是“瞎子”。
     """
-    plan = state["plan"]
-    task = plan[0]
+    tasks = ready_tasks(state)
     
-    print(f"--- [Executor] Working on: '{task}' ---")
+    print(f"--- [Executor] Working on: {tasks} ---")
     
     # [关键修复]: 构建上下文
-    # 把之前做过的步骤和结果拼起来
+    # 之前做过的步骤和结果已经累积在 state["context"] 里 (只追加)
     context = ""
-    if state["past_steps"]:
-        context = "Here is the context of what has been done so far:\n"
-        for step, result in state["past_steps"]:
-            context += f"Step: {step}\nResult: {result}\n---\n"
+    if state.get("context"):
+        context = "Here is the context of what has been done so far:\n" + state["context"]
     
     # 将上下文 + 当前任务一起发给 LLM
-    executor_prompt = (
-        "You are a helpful worker. "
-        "Execute the following task to the best of your ability."
-        "Use the provided context if necessary to complete the task."
-        "Provide a concise result."
-    )
-    
-    result = llm.invoke([
-        SystemMessage(content=executor_prompt),
-        HumanMessage(content=f"{context}\n\nCurrent Task: {task}")
+    # 消息顺序: 固定的 System Prompt -> 只追加的历史 -> 当前任务。前缀在多次调用间保持不变，
+    # 可以命中 OpenAI 的自动 Prompt Caching (>= 1024 tokens 的相同前缀)，省掉重复的 prefill
+    # 互不依赖的步骤用 abatch 并发请求，K 次串行往返变成一轮
+    results = await llm.abatch([
+        [
+            EXECUTOR_SYSTEM,
+            HumanMessage(content=f"{context}\n\nCurrent Task: {task}")
+        ]
+        for task in tasks
     ])
     
-    output = result.content
-    print(f"✅ Result: {output}")
+    outputs = [result.content for result in results]
+    for output in outputs:
+        print(f"✅ Result: {output}")
     
     return {
-        "past_steps": [(task, output)]
+        "past_steps": list(zip(tasks, outputs)),
+        "context": "".join(f"Step: {task}\nResult: {output}\n---\n" for task, output in zip(tasks, outputs)),
     }
 
-def replanner_node(state: PlanExecuteState):
-    """
-    Node 3: Re-Planner (反思者)
-    作用: 动态调整计划。
-    输入: Goal + Reality (已完成的事实)
-    输出: Gap (剩下的计划) 或 Response (最终答案)
-    这是架构中最性感的部分，提供了“纠错”能力。
-    """
-    print("--- [Re-Planner] Updating Plan... ---")
+# Re-Planner 的 Prompt 模板只构建一次，每次调用只填入目标/计划/已完成步骤
+# 核心修改：加强了 Instructions 部分的逻辑约束
+REPLANNER_PROMPT = """
+    Your objective: {objective}
     
-    replanner_llm = llm.with_structured_output(Response)
-    
-    # 构造上下文：目标 + 原计划 + 已完成
-    # 这里的 prompt 决定了 Agent 有多"聪明"
-    past_steps_format = "\n".join([f"Step: {s}\nResult: {r}" for s, r in state["past_steps"]])
-    
-    # 核心修改：加强了 Instructions 部分的逻辑约束
-    prompt = f"""
-    Your objective: {state['input']}
-    
-    Original Plan: {state['plan']}
+    Original Plan: {plan}
     
     Completed Steps:
-    {past_steps_format}
+    {past_steps}
     
     Instructions:
     1. Analyze the "Completed Steps". Did the last step successfully produce the final answer for the "Objective"?
@@ -168,9 +194,35 @@ def replanner_node(state: PlanExecuteState):
        
     3. IF NO (Objective is NOT Done):
        - Return a new list of *remaining* steps in 'plan'.
-       - Remove the step that was just completed.
+       - Remove the steps that were just completed.
        - Do NOT set 'response'.
     """
+
+def replanner_node(state: PlanExecuteState):
+    """
+    Node 3: Re-Planner (反思者)
+    作用: 动态调整计划。
+    输入: Goal + Reality (已完成的事实)
+    输出: Gap (剩下的计划) 或 Response (最终答案)
+    这是架构中最性感的部分，提供了“纠错”能力。
+    """
+    # 捷径: 计划只剩一步且刚执行完，这一步的结果就是最终答案 (Planner 约定最后一步产出答案)，
+    # 不用再花一次 LLM 调用去"确认"，router 随后直接 END
+    if len(state["plan"]) <= 1 and state["past_steps"]:
+        print("🎉 [Re-Planner] Last step done, skipping LLM check.")
+        return {"response": state["past_steps"][-1][1], "plan": []}
+    
+    print("--- [Re-Planner] Updating Plan... ---")
+    
+    # 构造上下文：目标 + 原计划 + 已完成
+    # 这里的 prompt 决定了 Agent 有多"聪明"
+    past_steps_format = "\n".join([f"Step: {s}\nResult: {r}" for s, r in state["past_steps"]])
+    
+    prompt = REPLANNER_PROMPT.format(
+        objective=state["input"],
+        plan=state["plan"],
+        past_steps=past_steps_format,
+    )
     
     result = replanner_llm.invoke(prompt)
     
@@ -181,7 +233,8 @@ def replanner_node(state: PlanExecuteState):
         return {"response": result.response, "plan": []}
     else:
         print(f"🔄 [Re-Planner] New Plan: {result.plan}")
-        return {"plan": result.plan}
+        # 重新规划后的步骤没有依赖信息，之后按顺序执行
+        return {"plan": result.plan, "dependencies": None}
 
 # ==========================================
 # 4. Graph Logic
@@ -199,7 +252,7 @@ def router(state: PlanExecuteState):
     # 3. 还有活，继续干
     return "executor"
 
-def main():
+async def main():
     builder = StateGraph(PlanExecuteState)
     
     builder.add_node("planner", planner_node)
@@ -228,7 +281,7 @@ def main():
     config = {"recursion_limit": 20}
     
     # 只需要简单的 stream 即可
-    for event in graph.stream({"input": user_query}, config=config):
+    async for event in graph.astream({"input": user_query}, config=config):
         pass # 日志已经在节点内部打印了
 
     # 获取最终结果
@@ -236,4 +289,4 @@ def main():
     # 但我们可以打印最后一次 event 或者上面的日志来验证
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
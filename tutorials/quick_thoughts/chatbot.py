@@ -1,7 +1,21 @@
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, message_chunk_to_message
 from dotenv import load_dotenv
 
+# 每次只把最近 HISTORY_WINDOW 条消息原样发给 LLM；更早的对话压缩成一段摘要。
+# 历史超过 2 倍窗口时才触发一次摘要 (而不是每轮都摘要)，摘要调用的开销被分摊到多轮对话上。
+HISTORY_WINDOW = 10
+
+def summarize(llm, summary, old_messages):
+    """把已有摘要和即将滑出窗口的消息合并成新的摘要"""
+    transcript = "\n".join(f"{m.type}: {m.content}" for m in old_messages)
+    prompt = (
+        "Update the running summary of this conversation with the new lines. "
+        "Keep names, facts and open questions; be concise.\n\n"
+        f"Current summary:\n{summary or '(empty)'}\n\nNew lines:\n{transcript}"
+    )
+    return llm.invoke([HumanMessage(content=prompt)]).content
+
 def main():
     load_dotenv()
 
@@ -16,9 +30,9 @@ def main():
 
     # 历史记录列表
     # 可以添加一个 SystemMessage 来设定人设
-    messages = [
-        SystemMessage(content="你是一个幽默风趣的 AI 助手。")
-    ]
+    system_message = SystemMessage(content="你是一个幽默风趣的 AI 助手。")
+    messages = []
+    summary = ""
 
     print("\n=== 终端聊天机器人 (输入 'quit', 'exit' 或 'q' 退出) ===\n")
 
@@ -38,15 +52,26 @@ def main():
             # 2. 将用户问题加入历史
             messages.append(HumanMessage(content=user_input))
 
-            # 3. 调用 LLM
-            # print("   (Thinking...)", end="\r") # 简单的加载提示
-            response = llm.invoke(messages)
+            # 3. 历史太长时，把窗口之外的部分压缩进摘要
+            if len(messages) > 2 * HISTORY_WINDOW:
+                summary = summarize(llm, summary, messages[:-HISTORY_WINDOW])
+                messages = messages[-HISTORY_WINDOW:]
 
-            # 4. 打印回答
-            print(f"🤖 AI:   {response.content}\n")
+            # 4. 调用 LLM: 人设 + 摘要 + 最近的对话，prompt 长度有上限
+            # print("   (Thinking...)", end="\r") # 简单的加载提示
+            prompt = [system_message]
+            if summary:
+                prompt.append(SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
+            # 5. 流式打印回答: 第一个 token 到达就开始显示，chunk 相加拼回完整的 AIMessage
+            print("🤖 AI:   ", end="", flush=True)
+            response = None
+            for chunk in llm.stream(prompt + messages):
+                print(chunk.content, end="", flush=True)
+                response = chunk if response is None else response + chunk
+            print("\n")
 
-            # 5. 将 AI 回答加入历史
-            messages.append(response)
+            # 6. 将 AI 回答加入历史
+            messages.append(message_chunk_to_message(response))
 
         except KeyboardInterrupt:
             # 捕获 Ctrl+C
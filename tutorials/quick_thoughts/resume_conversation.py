@@ -1,28 +1,31 @@
 import sqlite3
 import argparse
+import functools
 import sys
 import os
 
 # Ensure we can import from the parent/root directory
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+# tutorials/ 目录，用来导入 utils
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from dotenv import load_dotenv
-from typing import TypedDict, Annotated
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import BaseMessage, HumanMessage
+from typing import TypedDict
+from langchain_core.messages import HumanMessage, ToolMessage
 from langchain_core.tools import tool
-from langgraph.graph import StateGraph, START, END
-from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode, tools_condition
+from langgraph.graph import StateGraph, MessagesState, START, END
+from langgraph.types import Send
 from langgraph.checkpoint.sqlite import SqliteSaver
 
+from utils.llm import get_llm
+
 load_dotenv()
 
 # ==========================================
 # Re-define Graph Structure (Must match the original graph)
 # ==========================================
-class AgentState(TypedDict):
-    messages: Annotated[list[BaseMessage], add_messages]
+class ToolCallState(TypedDict):
+    tool_call: dict
 
 @tool
 def multiply(a: int, b: int) -> int:
@@ -35,44 +38,52 @@ def get_weather(city: str) -> str:
     return f"The weather in {city} is sunny and 25°C."
 
 tools = [multiply, get_weather]
-llm = ChatOpenAI(model="gpt-4.1-nano", temperature=0)
+tools_by_name = {t.name: t for t in tools}
+# temperature=0 + 磁盘缓存：重复恢复同一段对话时，相同的请求直接读缓存，不再走网络
+llm = get_llm("gpt-4.1-nano", 0, cached=True)
 llm_with_tools = llm.bind_tools(tools)
 
-def agent_node(state: AgentState):
+def agent_node(state: MessagesState):
     return {"messages": [llm_with_tools.invoke(state["messages"])]}
 
+def tool_runner_node(state: ToolCallState):
+    tool_call = state["tool_call"]
+    output = tools_by_name[tool_call["name"]].invoke(tool_call["args"])
+    return {"messages": [ToolMessage(content=str(output), tool_call_id=tool_call["id"], name=tool_call["name"])]}
+
+def dispatch_tools(state: MessagesState):
+    last_message = state["messages"][-1]
+    if not last_message.tool_calls:
+        return END
+    return [Send("tool_runner", {"tool_call": tc}) for tc in last_message.tool_calls]
+
 def build_graph(checkpointer):
-    builder = StateGraph(AgentState)
+    builder = StateGraph(MessagesState)
     builder.add_node("agent", agent_node)
-    builder.add_node("tools", ToolNode(tools))
+    builder.add_node("tool_runner", tool_runner_node)
     builder.add_edge(START, "agent")
-    builder.add_conditional_edges(
-        "agent",
-        tools_condition,
-        {"tools": "tools", END: END}
-    )
-    builder.add_edge("tools", "agent")
+    builder.add_conditional_edges("agent", dispatch_tools, ["tool_runner", END])
+    builder.add_edge("tool_runner", "agent")
     return builder.compile(checkpointer=checkpointer)
 
+@functools.lru_cache(maxsize=1)
+def get_graph(db_path: str):
+    """同一个数据库只连接/编译一次，多次 resume 复用同一个图"""
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    # WAL: 读不阻塞写；synchronous=NORMAL: 不在每次 commit 时 fsync
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    
+    # Using checkpointer to load state
+    return build_graph(SqliteSaver(conn))
+
 # ==========================================
 # Main Resume Logic
 # ==========================================
-def resume_conversation(thread_id: str, new_query: str, db_path: str):
+def resume_conversation(graph, thread_id: str, new_query: str):
     print(f"--- Resuming Conversation ---")
-    print(f"Database:  {db_path}")
     print(f"Thread ID: {thread_id}")
     
-    # Connect to existing database
-    if not os.path.exists(db_path):
-        print(f"Error: Database not found at {db_path}")
-        return
-
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    
-    # Using checkpointer to load state
-    checkpointer = SqliteSaver(conn)
-    graph = build_graph(checkpointer)
-    
     # Configuration with the same thread_id
     config = {"configurable": {"thread_id": thread_id}}
     
@@ -102,6 +113,12 @@ def resume_conversation(thread_id: str, new_query: str, db_path: str):
     print(f"Agent: {result['messages'][-1].content}")
     print("\n--- Conversation Saved ---")
 
+def resume_many(thread_queries, db_path: str):
+    """批量恢复: thread_queries 是 [(thread_id, query), ...]，所有请求共用一个已编译的图"""
+    graph = get_graph(db_path)
+    for thread_id, query in thread_queries:
+        resume_conversation(graph, thread_id, query)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Resume a LangGraph conversation from SQLite checkpoints")
     parser.add_argument("thread_id", nargs="?", default="user_neo", help="The thread ID to resume")
@@ -110,5 +127,11 @@ if __name__ == "__main__":
     
     args = parser.parse_args()
     
-    resume_conversation(args.thread_id, args.query, args.db)
+    # Connect to existing database
+    print(f"Database:  {args.db}")
+    if not os.path.exists(args.db):
+        print(f"Error: Database not found at {args.db}")
+        sys.exit(1)
+    
+    resume_conversation(get_graph(args.db), args.thread_id, args.query)
 
@@ -46,6 +46,9 @@ def run_chat(thread_id: str, db_path: str):
         return
 
     conn = sqlite3.connect(db_path, check_same_thread=False)
+    # WAL: 读不阻塞写；synchronous=NORMAL: 不在每次 commit 时 fsync
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
     
     # 注意：如果这里的 Graph 结构（节点名称）和之前保存该 Thread ID 时使用的结构不一样
     # LangGraph 可能无法正确加载所有状态。但对于 messages 列表通常是兼容的。
@@ -86,10 +89,13 @@ def run_chat(thread_id: str, db_path: str):
             # 调用 Graph
             # LangGraph 会自动：加载历史 -> 追加新消息 -> 执行 LLM -> 保存新状态
             # stream_mode="values" 会返回每一步的状态值
+            # durability="exit": 每轮对话只在图跑完时写一次 checkpoint，而不是每个 superstep 都写；
+            # 代价是这一轮中途出错时，本轮的输入不会被保存
             events = graph.stream(
                 {"messages": [HumanMessage(content=user_input)]},
                 config=config,
-                stream_mode="values"
+                stream_mode="values",
+                durability="exit",
             )
             
             # 打印最后一条消息（AI 的回复）
@@ -0,0 +1,22 @@
+def register_nodes(builder, nodes):
+    """
+    批量注册节点。
+
+    Args:
+        builder: StateGraph 构建器
+        nodes: {节点名: 节点函数} 的字典，按插入顺序注册
+    """
+    for name, fn in nodes.items():
+        builder.add_node(name, fn)
+
+
+def register_edges(builder, edges):
+    """
+    批量注册普通边 (不含条件边)。
+
+    Args:
+        builder: StateGraph 构建器
+        edges: [(起点, 终点), ...] 的列表
+    """
+    for source, target in edges:
+        builder.add_edge(source, target)
@@ -1,6 +1,9 @@
 import sqlite3
 import argparse
+import json
 import os
+import sys
+from collections import deque
 from contextlib import contextmanager
 from langgraph.checkpoint.sqlite import SqliteSaver
 
@@ -16,7 +19,14 @@ def get_saver(db_path: str):
     finally:
         conn.close()
 
-def inspect_checkpoints(db_path: str, limit: int = 5, thread_id: str = None):
+def format_value(value, max_chars: int) -> str:
+    """Pretty-print a checkpoint field as JSON, truncated to max_chars."""
+    text = json.dumps(value, default=str, indent=2, ensure_ascii=False)
+    if len(text) > max_chars:
+        text = text[:max_chars] + f"... [truncated, {len(text)} chars total]"
+    return text
+
+def inspect_checkpoints(db_path: str, limit: int = 5, thread_id: str = None, max_chars: int = 2000):
     if not os.path.exists(db_path):
         print(f"Error: Database file not found at {db_path}")
         return
@@ -34,7 +44,8 @@ def inspect_checkpoints(db_path: str, limit: int = 5, thread_id: str = None):
             # This returns an iterator of CheckpointTuple objects
             # CheckpointTuple contains: config, checkpoint, metadata, parent_config, pending_writes
             print(f"Fetching checkpoints (limit={limit}, thread_id={thread_id})...")
-            checkpoint_tuples = list(saver.list(config, limit=limit))
+            # saver.list is a lazy iterator (newest first); the bounded deque never holds more than limit records
+            checkpoint_tuples = deque(saver.list(config, limit=limit), maxlen=limit)
 
             if not checkpoint_tuples:
                 print("No checkpoints found.")
@@ -42,11 +53,10 @@ def inspect_checkpoints(db_path: str, limit: int = 5, thread_id: str = None):
 
             print(f"Found {len(checkpoint_tuples)} checkpoint(s). Showing oldest to newest:\n")
             
-            # Reverse the list to show in chronological order
-            checkpoint_tuples.reverse()
-            
-            for i, cp_tuple in enumerate(checkpoint_tuples):
-                print(f"--- Record {i+1} ---")
+            # Iterate in reverse to show in chronological order
+            for i, cp_tuple in enumerate(reversed(checkpoint_tuples)):
+                # Collect the whole record and write it in one call instead of one print per line
+                lines = [f"--- Record {i+1} ---"]
                 config = cp_tuple.config
                 checkpoint = cp_tuple.checkpoint
                 metadata = cp_tuple.metadata
@@ -55,22 +65,23 @@ def inspect_checkpoints(db_path: str, limit: int = 5, thread_id: str = None):
                 c_id = checkpoint.get("id", "N/A")
                 ts = checkpoint.get("ts", "N/A")
                 
-                print(f"Thread ID:     {t_id}")
-                print(f"Checkpoint ID: {c_id}")
-                print(f"Timestamp:     {ts}")
+                lines.append(f"Thread ID:     {t_id}")
+                lines.append(f"Checkpoint ID: {c_id}")
+                lines.append(f"Timestamp:     {ts}")
                 
-                print("\n[Checkpoint Data (Channel Values)]")
-                # Automatically decoded channel values
-                print(checkpoint.get("channel_values", {}))
+                lines.append("\n[Checkpoint Data (Channel Values)]")
+                # Automatically decoded channel values; long message lists are truncated
+                lines.append(format_value(checkpoint.get("channel_values", {}), max_chars))
                 
-                print("\n[Metadata]")
-                print(metadata)
+                lines.append("\n[Metadata]")
+                lines.append(format_value(metadata, max_chars))
                 
                 if cp_tuple.pending_writes:
-                    print("\n[Pending Writes]")
-                    print(cp_tuple.pending_writes)
+                    lines.append("\n[Pending Writes]")
+                    lines.append(format_value(cp_tuple.pending_writes, max_chars))
                     
-                print("-" * 50 + "\n")
+                lines.append("-" * 50 + "\n\n")
+                sys.stdout.write("\n".join(lines))
                 
     except Exception as e:
         print(f"Error inspecting checkpoints: {e}")
@@ -82,9 +93,10 @@ if __name__ == "__main__":
     parser.add_argument("db_path", nargs="?", default="../checkpoints/checkpoints.sqlite", help="Path to the sqlite database file")
     parser.add_argument("--limit", type=int, default=20, help="Number of checkpoints to show")
     parser.add_argument("--thread", type=str, help="Filter by thread_id")
+    parser.add_argument("--max-chars", type=int, default=2000, help="Truncate each printed field to this many characters")
     
     args = parser.parse_args()
-    inspect_checkpoints(args.db_path, args.limit, args.thread)
+    inspect_checkpoints(args.db_path, args.limit, args.thread, args.max_chars)
 
 # Example usage:
 # uv run tutorials/utils/inspect_checkpoint.py tutorials/checkpoints/checkpoints.sqlite --thread user_neo --limit 20
\ No newline at end of file
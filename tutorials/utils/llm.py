@@ -0,0 +1,45 @@
+"""
+教程共用的 ChatOpenAI 工厂。
+
+每个 ChatOpenAI 默认各自创建 httpx 连接池；这里所有实例共用同一组 httpx client，
+多个教程/节点复用 TCP 连接，TLS 握手只在第一次请求时发生。
+"""
+
+from functools import lru_cache
+from importlib.util import find_spec
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from utils.llm_cache import get_llm_cache
+
+# 与 openai SDK 默认超时一致 (600s，连接 5s)
+_TIMEOUT = httpx.Timeout(600.0, connect=5.0)
+# Send 扇出的并行 Worker 同时在途，连接池要放得下
+_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+# HTTP/2 让并行请求复用同一条连接；需要可选依赖 h2 (pip install "httpx[http2]")，没装就退回 HTTP/1.1
+_HTTP2 = find_spec("h2") is not None
+
+SHARED_HTTP_CLIENT = httpx.Client(timeout=_TIMEOUT, limits=_LIMITS, http2=_HTTP2)
+SHARED_HTTP_ASYNC_CLIENT = httpx.AsyncClient(timeout=_TIMEOUT, limits=_LIMITS, http2=_HTTP2)
+
+@lru_cache(maxsize=16)
+def get_llm(model: str, temperature: float = 0.0, cached: bool = False) -> ChatOpenAI:
+    """
+    按 (model, temperature, cached) 返回单例 ChatOpenAI。
+
+    Args:
+        model: OpenAI 模型名，如 "gpt-4.1-nano"
+        temperature: 采样温度
+        cached: 是否挂上磁盘 LLM 缓存 (utils.llm_cache)；只允许 temperature=0 的模型使用，
+            否则重跑会逐字回放上一次的采样结果，Demo 不再有随机性
+    """
+    if cached and temperature != 0:
+        raise ValueError(f"cached=True requires temperature=0 (got {temperature}) for model {model!r}")
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        http_client=SHARED_HTTP_CLIENT,
+        http_async_client=SHARED_HTTP_ASYNC_CLIENT,
+        cache=get_llm_cache() if cached else None,
+    )
@@ -0,0 +1,78 @@
+"""
+LLM 响应的磁盘缓存。
+
+作为 ChatOpenAI(cache=...) 传入，LangChain 会在真正请求 OpenAI 之前先查缓存。
+key 是 (prompt 序列化结果, 模型参数) 的 SHA-256，所以只有完全相同的请求才会命中：
+同一个 Demo 重跑时，不再重复支付网络往返和 token 费用。
+缓存挂在模型上 (而不是包一层 Wrapper)，with_structured_output / bind_tools / create_agent 都能照常使用。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from functools import lru_cache
+
+from langchain_core.caches import BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration
+
+# 放在 tutorials/checkpoints/ 下 (按本文件定位，与当前工作目录无关)
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "checkpoints", "llm_cache.sqlite"
+)
+
+class SQLiteLLMCache(BaseCache):
+    """按 (prompt, llm_string) 精确匹配的 SQLite 缓存"""
+
+    def __init__(self, database_path=DEFAULT_CACHE_PATH):
+        # 并行的 Worker 可能在不同线程里查缓存，用一把锁串行化对同一连接的访问
+        self._lock = threading.Lock()
+        self._database_path = database_path
+        # 第一次查/写缓存时才打开数据库: get_llm(cached=True) 常在模块加载时调用，import 不应创建文件
+        self._conn_or_none = None
+
+    @property
+    def _conn(self):
+        """调用方需持有 self._lock"""
+        if self._conn_or_none is None:
+            conn = sqlite3.connect(self._database_path, check_same_thread=False)
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn_or_none = conn
+        return self._conn_or_none
+
+    @staticmethod
+    def _key(prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode()).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ?", (self._key(prompt, llm_string),)
+            ).fetchone()
+        if row is None:
+            return None
+        return [
+            ChatGeneration(message=messages_from_dict([message])[0])
+            for message in json.loads(row[0])
+        ]
+
+    def update(self, prompt, llm_string, return_val):
+        value = json.dumps([message_to_dict(generation.message) for generation in return_val])
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value) VALUES (?, ?)",
+                (self._key(prompt, llm_string), value),
+            )
+
+    def clear(self, **kwargs):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM llm_cache")
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache():
+    """进程内共用一个缓存实例 (第一次真正查询缓存时才创建数据库文件)"""
+    return SQLiteLLMCache()
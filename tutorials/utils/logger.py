@@ -0,0 +1,35 @@
+"""
+教程共用的节点日志。
+
+节点内部只把 LogRecord 放进队列 (QueueHandler)，写 stdout 由后台的
+QueueListener 线程完成，并行的 Worker 不会在同一个 stdout 锁上排队。
+节点里请使用 %-style 参数 (logger.info("... %s", value))，日志级别关闭时不会做字符串格式化。
+main() 里直接 print 之前先调用 flush_logs()，否则节点日志可能晚于 print 出现，输出顺序不确定。
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+# 用 queue.Queue 而不是 SimpleQueue: QueueListener 每写完一条会调用 task_done()，flush_logs 可以 join 等待
+_log_queue = queue.Queue()
+
+_stream_handler = logging.StreamHandler(sys.stdout)
+_stream_handler.setFormatter(logging.Formatter("%(message)s"))
+
+_listener = logging.handlers.QueueListener(_log_queue, _stream_handler)
+_listener.start()
+# 进程退出前把队列里剩余的日志写完
+atexit.register(_listener.stop)
+
+logger = logging.getLogger("tutorial")
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.propagate = False
+
+
+def flush_logs():
+    """阻塞直到队列里已有的日志全部写到 stdout；队列为空时立即返回。"""
+    _log_queue.join()
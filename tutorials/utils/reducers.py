@@ -0,0 +1,18 @@
+"""
+教程共用的 State reducer。
+"""
+
+from langgraph.graph.message import add_messages
+
+
+def bounded_messages(max_len: int):
+    """
+    返回一个只保留最近 max_len 条消息的 reducer。
+
+    合并规则与 add_messages 相同 (按 id 去重/替换)，只是窗口满了以后丢掉最早的消息，
+    这样 messages 通道的大小不会随迭代轮数增长，每个 checkpoint 的序列化成本也是常数。
+    适合只给人看的审计日志通道；Worker 不应依赖被裁掉的历史。
+    """
+    def reducer(left, right):
+        return add_messages(left, right)[-max_len:]
+    return reducer
@@ -0,0 +1,121 @@
+"""
+教程用的轻量 Checkpointer。
+"""
+
+from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple, copy_checkpoint
+
+
+class LatestOnlySaver(BaseCheckpointSaver):
+    """
+    每个 thread 只保留最新一个 checkpoint 的内存 Checkpointer。
+
+    MemorySaver 会把每一步的 State 序列化后保存完整历史；HITL 场景恢复执行只需要
+    最新的快照，所以这里直接保存对象引用 (浅拷贝)，不做任何序列化。
+    代价是不支持 Time Travel：get_state_history 只能看到最新一条。
+    """
+
+    def __init__(self):
+        super().__init__()
+        # (thread_id, checkpoint_ns) -> CheckpointTuple
+        self._latest = {}
+        # (thread_id, checkpoint_ns) -> {(task_id, idx): (task_id, channel, value)}
+        self._writes = {}
+
+    @staticmethod
+    def _key(config):
+        configurable = config["configurable"]
+        return configurable["thread_id"], configurable.get("checkpoint_ns", "")
+
+    def get_tuple(self, config):
+        key = self._key(config)
+        saved = self._latest.get(key)
+        if saved is None:
+            return None
+
+        # 只保留了最新一条，请求更早的 checkpoint_id 时视为不存在
+        checkpoint_id = config["configurable"].get("checkpoint_id")
+        if checkpoint_id and checkpoint_id != saved.checkpoint["id"]:
+            return None
+
+        # Pregel 会原地修改加载到的 checkpoint (channel_versions/versions_seen)，和 put 一样交出浅拷贝，
+        # 否则保存的"最新快照"会在下一次 put 之前被改掉
+        return saved._replace(
+            checkpoint=copy_checkpoint(saved.checkpoint),
+            pending_writes=list(self._writes.get(key, {}).values()),
+        )
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        if limit is not None and limit <= 0:
+            return
+        if config is None:
+            keys = list(self._latest)
+        else:
+            keys = [self._key(config)]
+
+        count = 0
+        for key in keys:
+            saved = self.get_tuple({"configurable": {"thread_id": key[0], "checkpoint_ns": key[1]}})
+            if saved is None:
+                continue
+            if filter and any(saved.metadata.get(k) != v for k, v in filter.items()):
+                continue
+            if before and saved.checkpoint["id"] >= before["configurable"]["checkpoint_id"]:
+                continue
+            yield saved
+            count += 1
+            if limit is not None and count >= limit:
+                return
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id, checkpoint_ns = self._key(config)
+        new_config = {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+        parent_config = config if config["configurable"].get("checkpoint_id") else None
+
+        # 覆盖旧快照，旧快照的 pending writes 一并丢弃
+        self._latest[(thread_id, checkpoint_ns)] = CheckpointTuple(
+            config=new_config,
+            checkpoint=copy_checkpoint(checkpoint),
+            metadata=metadata,
+            parent_config=parent_config,
+            pending_writes=[],
+        )
+        self._writes[(thread_id, checkpoint_ns)] = {}
+        return new_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        key = self._key(config)
+        saved = self._latest.get(key)
+        if saved is None or saved.checkpoint["id"] != config["configurable"].get("checkpoint_id"):
+            return
+
+        task_writes = self._writes.setdefault(key, {})
+        for idx, (channel, value) in enumerate(writes):
+            task_writes.setdefault((task_id, idx), (task_id, channel, value))
+
+    def delete_thread(self, thread_id):
+        for key in [k for k in self._latest if k[0] == thread_id]:
+            del self._latest[key]
+            self._writes.pop(key, None)
+
+    # --- Async API: 纯内存操作，直接复用同步实现 ---
+    async def aget_tuple(self, config):
+        return self.get_tuple(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        self.delete_thread(thread_id)
@@ -0,0 +1,112 @@
+"""
+教程用的 SQLite Checkpointer 扩展。
+
+单独放一个模块：依赖 langgraph-checkpoint-sqlite，不想让只用 utils.savers 的教程 (05) 也要装它。
+"""
+
+import asyncio
+
+from langgraph.checkpoint.base import WRITES_IDX_MAP
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+_INSERT_WRITES = (
+    "INSERT OR {action} INTO writes "
+    "(thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+class CoalescingAsyncSqliteSaver(AsyncSqliteSaver):
+    """
+    把短时间内的 aput_writes 合并成一次事务提交的 AsyncSqliteSaver。
+
+    Send 扇出的每个并行任务一完成，LangGraph 就会单独调用一次 aput_writes，
+    N 个 Worker = N 次写事务 (N 次 commit)。这里先把写入放进内存缓冲，
+    等 flush_delay 秒 (默认 50ms) 或者下一次 aput / 读取时，在一个事务里一起写入。
+
+    代价: 进程在缓冲窗口内崩溃，这部分已完成任务的写入会丢失，恢复时这些任务要重跑。
+    退出前请调用 aflush()，把缓冲里剩下的写入落盘。
+    """
+
+    def __init__(self, conn, *, serde=None, flush_delay: float = 0.05):
+        super().__init__(conn, serde=serde)
+        self.flush_delay = flush_delay
+        # [(config, writes, task_id), ...] 按到达顺序保存
+        self._pending = []
+        self._timer = None
+        self._inflight = set()
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        self._pending.append((config, writes, task_id))
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.flush_delay, self._start_flush)
+
+    def _start_flush(self):
+        self._timer = None
+        task = asyncio.ensure_future(self._flush())
+        # 保留引用，避免任务被 GC；aflush 也要等它们写完
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    def _rows(self, config, writes, task_id):
+        configurable = config["configurable"]
+        return [
+            (
+                str(configurable["thread_id"]),
+                str(configurable["checkpoint_ns"]),
+                str(configurable["checkpoint_id"]),
+                task_id,
+                WRITES_IDX_MAP.get(channel, idx),
+                channel,
+                *self.serde.dumps_typed(value),
+            )
+            for idx, (channel, value) in enumerate(writes)
+        ]
+
+    async def _flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        await self.setup()
+        async with self.lock, self.conn.cursor() as cur:
+            # 连接可能是 autocommit (isolation_level=None)，显式开事务，保证只 commit 一次
+            if not self.conn.in_transaction:
+                await cur.execute("BEGIN")
+            for config, writes, task_id in batch:
+                # 与 AsyncSqliteSaver.aput_writes 相同: 特殊通道 (错误/中断等) 覆盖，普通写入不覆盖
+                action = "REPLACE" if all(w[0] in WRITES_IDX_MAP for w in writes) else "IGNORE"
+                await cur.executemany(_INSERT_WRITES.format(action=action), self._rows(config, writes, task_id))
+            await self.conn.commit()
+
+    async def aflush(self):
+        """立即写入缓冲中的全部 writes，并等待已经开始的后台 flush 完成。"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self._flush()
+        if self._inflight:
+            await asyncio.gather(*self._inflight)
+
+    # --- 写 checkpoint / 读取之前先落盘缓冲，保证读到自己刚写的 pending writes ---
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        await self.aflush()
+        return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aget_tuple(self, config):
+        await self.aflush()
+        return await super().aget_tuple(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        await self.aflush()
+        async for item in super().alist(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def adelete_thread(self, thread_id):
+        await self.aflush()
+        await super().adelete_thread(thread_id)
+
+    async def aget_delta_channel_history(self, *args, **kwargs):
+        await self.aflush()
+        return await super().aget_delta_channel_history(*args, **kwargs)
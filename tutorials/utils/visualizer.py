@@ -1,28 +1,69 @@
+import asyncio
+import hashlib
 import os
+import shutil
+from importlib.util import find_spec
+
+from langchain_core.runnables.graph import MermaidDrawMethod
+
+# 可选: 装了 pyppeteer (项目依赖里没有，需自行 pip install；首次使用会下载 Chromium)
+# 就在本地用无头浏览器渲染，不走网络；否则退回 mermaid.ink
+_HAS_PYPPETEER = find_spec("pyppeteer") is not None
+
+def _draw_method() -> MermaidDrawMethod:
+    """
+    LangChain 的 PYPPETEER 分支内部调用 asyncio.run()，在已经运行的事件循环里 (async main) 会直接报错，
+    所以只在没有运行中的事件循环时才用本地渲染。
+    """
+    if not _HAS_PYPPETEER:
+        return MermaidDrawMethod.API
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return MermaidDrawMethod.PYPPETEER
+    return MermaidDrawMethod.API
 
 def visualize_graph(graph, filename="graph_structure.png"):
     """
     将 LangGraph 的图结构保存为 PNG 图片。
-    
+
+    draw_mermaid_png() 默认会请求 mermaid.ink 远程渲染，比图本身的运行还慢，
+    所以只有设置了环境变量 RENDER_GRAPH 时才会绘图。
+    渲染结果按 Mermaid 源码 (本地生成，很便宜) 的哈希缓存在 images/.cache/ 下，图没变就直接复用。
+
     Args:
         graph: 编译后的 LangGraph 对象 (CompiledGraph)
         filename: 保存的文件名 (包含扩展名)，将自动保存在 images/ 目录下
     """
+    if not os.environ.get("RENDER_GRAPH"):
+        return
+
     try:
         # 确保 images 目录存在
-        os.makedirs("images", exist_ok=True)
-        
+        cache_dir = os.path.join("images", ".cache")
+        os.makedirs(cache_dir, exist_ok=True)
+
         # 拼接完整路径
         output_path = os.path.join("images", filename)
-        
+
+        drawable = graph.get_graph()
+        source_hash = hashlib.blake2b(drawable.draw_mermaid().encode()).hexdigest()[:16]
+        cache_path = os.path.join(cache_dir, f"{source_hash}.png")
+
+        # 命中缓存: 跳过网络渲染
+        if os.path.exists(cache_path):
+            shutil.copyfile(cache_path, output_path)
+            print(f"Graph image restored from cache to '{output_path}'")
+            return
+
         # 生成并保存图片
-        png_data = graph.get_graph().draw_mermaid_png()
-        with open(output_path, "wb") as f:
+        png_data = drawable.draw_mermaid_png(draw_method=_draw_method())
+        with open(cache_path, "wb") as f:
             f.write(png_data)
-            
+        shutil.copyfile(cache_path, output_path)
+
         print(f"Graph image saved to '{output_path}'")
-        
+
     except Exception as e:
         # 捕获异常并打印，避免因绘图失败影响主流程
         print(f"Skipping graph visualization: {e}")
-